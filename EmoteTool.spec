@@ -6,7 +6,7 @@ a = Analysis(
     ['main.py'],
     pathex=[],
     binaries=[],
-    datas=[],
+    datas=[('known_templates.json', '.')],
     hiddenimports=[
         'PIL._tkinter_finder',
         'PIL._imagingtk',
@@ -0,0 +1,260 @@
+"""
+Animated emote export (APNG, GIF and WebP sheets).
+
+Detection runs once on the first frame (LoadedTemplate decodes only that one).
+Export then streams the sheet frame by frame: every frame is cropped per cell
+and each cell's size chain is resized in parallel, and only the small resized
+frames are kept - memory grows with frames x output size, never with full
+sheet frames. Each (cell, size) is encoded once into an animated GIF or WebP.
+
+    _, cell_infos = detect_emotes_with_rects("animated_sheet.gif")
+    name_entries = [(cell, "") for cell in cell_infos if cell["has_content"]]
+    export_animated_emotes("animated_sheet.gif", name_entries, ["twitch", "discord"], image_format="webp")
+
+Platforms without animated emotes get the reference frame as a static PNG.
+"""
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from core import RESAMPLERS, _as_template, close_logging, export_emotes, plan_export, setup_logging
+from instrumentation import stage
+
+
+# Upload limits for animated emotes. max_frames None = no frame limit
+animated_platform_limits = {
+    "twitch": {"max_frames": 60, "max_bytes": 1024 * 1024},
+    "discord": {"max_frames": None, "max_bytes": 256 * 1024},
+    "kick": {"max_frames": None, "max_bytes": 1024 * 1024},
+}
+
+ANIMATED_FORMATS = ("gif", "webp")
+
+# Bounded search when a file is over its byte limit: (WebP quality, keep every n-th frame)
+BUDGET_STEPS = {
+    "webp": ((90, 1), (75, 1), (60, 1), (60, 2), (45, 2), (45, 3)),
+    "gif": ((None, 1), (None, 2), (None, 3), (None, 4)),
+}
+
+# Full-size frames decoded ahead of the resize threads - bounds peak memory
+FRAMES_IN_FLIGHT = 2
+
+DEFAULT_FRAME_DURATION = 100
+
+
+def is_animated(source):
+    """True if the template (filename or LoadedTemplate) has more than one frame"""
+    return _as_template(source).frame_count > 1
+
+
+def keep_frames(frame_count, max_frames):
+    """Indices of the frames to keep, spread evenly when a platform allows fewer frames"""
+    if not max_frames or frame_count <= max_frames:
+        return list(range(frame_count))
+    return sorted(set(np.linspace(0, frame_count - 1, max_frames).round().astype(int).tolist()))
+
+
+def _job_limits(job):
+    """Strictest frame and byte limits among the platforms a job writes for"""
+    frames = [animated_platform_limits[p]["max_frames"] for p, _ in job["files"]]
+    frames = [f for f in frames if f]
+    return min(frames) if frames else None, min(animated_platform_limits[p]["max_bytes"] for p, _ in job["files"])
+
+
+def _decimate(frames, durations, step):
+    """Keep every step-th frame; dropped frames add their time to the one before so speed stays the same"""
+    if step == 1:
+        return frames, durations
+    kept, kept_durations = [], []
+    for i in range(0, len(frames), step):
+        kept.append(frames[i])
+        kept_durations.append(sum(durations[i:i + step]))
+    return kept, kept_durations
+
+
+def _save_animation(frames, durations, image_format, quality):
+    buffer = io.BytesIO()
+    if image_format == "gif":
+        # disposal 2 clears every frame, otherwise transparent areas keep the previous frame
+        frames[0].save(buffer, format="GIF", save_all=True, append_images=frames[1:], duration=durations,
+                       loop=0, disposal=2, optimize=False)
+    else:
+        frames[0].save(buffer, format="WEBP", save_all=True, append_images=frames[1:], duration=durations,
+                       loop=0, quality=quality, method=4)
+    return buffer.getvalue()
+
+
+def encode_animation(frames, durations, image_format="gif", byte_budget=None):
+    """
+    Encode resized RGBA frames as an animated GIF/WebP.
+    Over byte_budget, tries lower WebP quality and then fewer frames, and returns the
+    first encoding that fits (or the smallest one). Returns (data, info).
+    """
+    candidates = []
+    for quality, step in BUDGET_STEPS[image_format]:
+        kept, kept_durations = _decimate(frames, durations, step)
+        data = _save_animation(kept, kept_durations, image_format, quality)
+        candidates.append((data, {"frames": len(kept), "quality": quality, "over_budget": False}))
+        if byte_budget is None or len(data) <= byte_budget:
+            return candidates[-1]
+    data, info = min(candidates, key=lambda c: len(c[0]))
+    info["over_budget"] = True
+    return data, info
+
+
+def _resize_frame(crop, targets, resampler, trace):
+    """Resize one cell of one frame to every size that keeps this frame; targets are (job, frame slot)"""
+    with stage(trace, "resize", cell=targets[0][0]["cell"]["id"], sizes=len(targets), resampler=resampler):
+        sized = RESAMPLERS[resampler](crop, [job["size"] for job, _ in targets])
+    for job, slot in targets:
+        job["frames"][slot] = sized[job["size"]]
+
+
+def _encode_job(job, image_format, out_dir, trace):
+    start = time.perf_counter()
+    with stage(trace, "encode", size=f"{job['size'][0]}x{job['size'][1]}", cell=job["cell"]["id"]):
+        data, info = encode_animation(job["frames"], job["durations"], image_format, job["max_bytes"])
+    job["encode_ms"] = (time.perf_counter() - start) * 1000
+    job["bytes"] = len(data)
+    job["encoding"] = info
+    # Resized frames are not needed any more
+    job["frames"] = None
+    with stage(trace, "write", files=len(job["files"]), bytes=len(data)):
+        for _, filename in job["files"]:
+            with open(os.path.join(out_dir, filename), "wb") as f:
+                f.write(data)
+    return job
+
+
+def export_animated_emotes(source, name_entries, selected_platforms, image_format="gif", debug_enabled=False,
+                           max_workers=None, progress_callback=None, cancel_event=None, trace=None, report=None,
+                           output_dir=None, resampler="pil"):
+    """
+    Export animated emotes for every platform in selected_platforms.
+    source is the animated sheet (filename or LoadedTemplate); name_entries come from
+    detection on its first frame, exactly like export_emotes.
+    progress_callback(frames_done, frames_total) is called while frames are streamed.
+    Report entries carry file, platform, size, frames, bytes, encode time and over_budget.
+    resampler picks the resize backend, see core.RESAMPLERS.
+    Returns (exported_count, out_dir).
+    """
+    if image_format not in ANIMATED_FORMATS:
+        raise ValueError(f"Unknown animated format '{image_format}', expected one of {ANIMATED_FORMATS}")
+    template = _as_template(source, trace)
+    out_dir = output_dir or os.path.join(os.path.dirname(template.path), "emotes_export_multi")
+    os.makedirs(out_dir, exist_ok=True)
+
+    # Badges and YouTube emotes can't be animated - they get the reference frame as PNG
+    static_platforms = [p for p in selected_platforms if p not in animated_platform_limits]
+    animated_platforms = [p for p in selected_platforms if p in animated_platform_limits]
+    static_count = 0
+    if static_platforms:
+        static_count, _ = export_emotes(
+            template, name_entries, static_platforms, debug_enabled, max_workers, cancel_event=cancel_event,
+            trace=trace, report=report, output_dir=out_dir, resampler=resampler,
+        )
+
+    logger = None
+    if debug_enabled:
+        logger, _ = setup_logging(template.path)
+        logger.info("=== ANIMATED EXPORT STARTED ===")
+        logger.info(f"Source file: {template.path} ({template.frame_count} frames)")
+        logger.info(f"Animated platforms: {animated_platforms}, static: {static_platforms}")
+
+    # === STEP 1: Plan ===
+    jobs = plan_export(name_entries, animated_platforms)
+    frame_count = template.frame_count
+    for job in jobs:
+        ext = "." + image_format
+        job["files"] = [(platform, os.path.splitext(filename)[0] + ext) for platform, filename in job["files"]]
+        max_frames, job["max_bytes"] = _job_limits(job)
+        job["keep"] = keep_frames(frame_count, max_frames)
+        job["frames"] = [None] * len(job["keep"])
+        job["durations"] = [0] * len(job["keep"])
+
+    # === STEP 2: Stream frames ===
+    # Decode one full frame at a time, crop every cell and resize in parallel;
+    # at most FRAMES_IN_FLIGHT full frames are alive while the threads catch up
+    padding = 5
+    frames_done = 0
+    in_flight = []
+    if progress_callback is not None:
+        progress_callback(0, frame_count)
+    pool_size = trace.pool_size(max_workers) if trace else max_workers
+    with ThreadPoolExecutor(max_workers=pool_size) as pool, Image.open(template.path) as src:
+        for index in range(frame_count):
+            if cancel_event is not None and cancel_event.is_set():
+                break
+            with stage(trace, "decode_frame", frame=index):
+                src.seek(index)
+                frame = np.asarray(src.convert("RGBA"))
+            duration = src.info.get("duration") or DEFAULT_FRAME_DURATION
+
+            # Cell id -> (job, slot) pairs that keep this frame
+            targets = {}
+            for job in jobs:
+                # Frames dropped for a frame limit add their time to the last kept frame
+                slot = int(np.searchsorted(job["keep"], index, side="right")) - 1
+                job["durations"][slot] += duration
+                if job["keep"][slot] == index:
+                    targets.setdefault(job["cell"]["id"], []).append((job, slot))
+            futures = []
+            for cell_targets in targets.values():
+                x, y, w, h = cell_targets[0][0]["cell"]["rect"]
+                crop = frame[y + padding:y + h - padding, x + padding:x + w - padding]
+                futures.append(pool.submit(_resize_frame, crop, cell_targets, resampler, trace))
+            del frame
+
+            in_flight.append(futures)
+            if len(in_flight) >= FRAMES_IN_FLIGHT:
+                for future in in_flight.pop(0):
+                    future.result()
+                frames_done += 1
+                if progress_callback is not None:
+                    progress_callback(frames_done, frame_count)
+        for futures in in_flight:
+            for future in futures:
+                future.result()
+            frames_done += 1
+        if progress_callback is not None:
+            progress_callback(frames_done, frame_count)
+
+        cancelled = cancel_event is not None and cancel_event.is_set()
+
+        # === STEP 3: Encode ===
+        exported_count = 0
+        if not cancelled:
+            for job in pool.map(lambda j: _encode_job(j, image_format, out_dir, trace), jobs):
+                exported_count += len(job["files"])
+                for platform, filename in job["files"]:
+                    if report is not None:
+                        report.append({
+                            "file": filename,
+                            "platform": platform,
+                            "size": f"{job['size'][0]}x{job['size'][1]}",
+                            "bytes": job["bytes"],
+                            "encode_ms": job["encode_ms"],
+                            "profile": image_format,
+                            **job["encoding"],
+                            "status": "written",
+                        })
+                    if debug_enabled:
+                        logger.debug(
+                            f"  Saved: {filename} for {platform} ({job['encoding']['frames']} frames, "
+                            f"{job['bytes']} bytes, encode {job['encode_ms']:.1f} ms)"
+                        )
+                        if job["encoding"]["over_budget"]:
+                            logger.warning(f"  {filename} is over the {platform} size limit even with fewer frames")
+
+    if debug_enabled:
+        if cancelled:
+            logger.info(f"=== ANIMATED EXPORT CANCELLED after {frames_done} of {frame_count} frames ===")
+        else:
+            logger.info(f"=== ANIMATED EXPORT COMPLETE: {exported_count} animated files created ===")
+        close_logging(logger)
+
+    return exported_count + static_count, out_dir
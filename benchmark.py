@@ -0,0 +1,491 @@
+"""
+Benchmark suite with a synthetic template generator.
+
+Generates grid templates modeled on emote-template/new_emote-template.png
+(white sheet, header strip, transparent cells with a thin gray border, opaque
+"emotes" in some cells), times detection and export across resolution, grid
+size, fill ratio, noise and engine, and checks detection against the known
+ground truth so speed work can't silently break it.
+
+Usage:
+    python benchmark.py --output bench.json
+    python benchmark.py --resolutions 2670x1800 5340x3600 --grids 8x5 --engines contours pyramid grid
+    python benchmark.py --output new.json --compare bench.json
+    python benchmark.py --resamplers pil opencv   # export speed per backend + PSNR parity against PIL
+    python benchmark.py --check-parity            # just the PIL-vs-OpenCV parity check on a fixed crop
+    python benchmark.py --check-tiling            # just tiled vs whole-sheet detection on weak-bordered cells
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+from core import DETECTION_ENGINES, RESAMPLERS, detect_emotes_with_rects, export_emotes, load_template, platform_sizes
+from instrumentation import current_rss
+
+
+def make_synthetic_template(width=2670, height=1800, cols=8, rows=5, fill_ratio=0.8, noise=0.0,
+                            antialias=False, seed=0):
+    """
+    Build a template like the shipped one at any resolution/grid.
+    Returns (RGBA image, ground truth) where ground truth is a list of
+    {"rect": (x, y, w, h), "filled": bool} in reading order.
+
+    noise: std-dev of gaussian noise added to opaque pixels (0-255 scale)
+    antialias: draw at 2x and downsample, giving soft edges like real exports
+    """
+    rng = random.Random(seed)
+    ss = 2 if antialias else 1
+    W, H = width * ss, height * ss
+
+    # Same proportions as the shipped template: gap and margin 1/10 of a cell, header 1/2 cell
+    cell = min(W / (cols + (cols + 1) * 0.1), H / (rows + (rows + 1) * 0.1 + 0.4))
+    gap = cell * 0.1
+    header = H - rows * cell - (rows + 1) * gap
+    x_start = (W - cols * cell - (cols - 1) * gap) / 2
+
+    img = Image.new("RGBA", (W, H), (255, 255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    # Header text stand-in and color splotches
+    draw.rectangle([x_start, header * 0.25, x_start + cell * 2.2, header * 0.6], fill=(0, 0, 0, 255))
+    for i, color in enumerate([(0, 160, 230), (230, 0, 126), (255, 240, 0), (0, 0, 0)]):
+        cx = W - x_start - (i + 0.5) * cell * 0.3
+        draw.ellipse([cx - cell * 0.12, header * 0.2, cx + cell * 0.12, header * 0.7], fill=color + (255,))
+
+    truth = []
+    for r in range(rows):
+        for c in range(cols):
+            x0 = round(x_start + c * (cell + gap))
+            y0 = round(header + r * (cell + gap))
+            x1 = round(x_start + c * (cell + gap) + cell)
+            y1 = round(header + r * (cell + gap) + cell)
+            # Transparent cell with thin gray border, like the new template
+            draw.rectangle([x0, y0, x1 - 1, y1 - 1], fill=(0, 0, 0, 0), outline=(200, 200, 200, 255), width=ss)
+
+            filled = rng.random() < fill_ratio
+            if filled:
+                inset = (x1 - x0) * rng.uniform(0.08, 0.2)
+                color = (rng.randint(60, 255), rng.randint(60, 255), rng.randint(60, 255), 255)
+                shape = draw.ellipse if rng.random() < 0.5 else draw.rounded_rectangle
+                shape([x0 + inset, y0 + inset, x1 - inset, y1 - inset], fill=color)
+            truth.append({"rect": (x0 // ss, y0 // ss, (x1 - x0) // ss, (y1 - y0) // ss), "filled": filled})
+
+    if antialias:
+        img = img.filter(ImageFilter.GaussianBlur(0.6)).resize((width, height), Image.Resampling.LANCZOS)
+
+    if noise > 0:
+        arr = np.array(img)
+        np_rng = np.random.default_rng(seed)
+        opaque = arr[:, :, 3] > 0
+        # float32 throughout - float64 noise for an 8K sheet is over a gigabyte
+        rgb = arr[:, :, :3].astype(np.float32)
+        rgb += np_rng.standard_normal(rgb.shape, dtype=np.float32) * noise * opaque[:, :, None]
+        arr[:, :, :3] = np.clip(rgb, 0, 255).astype(np.uint8)
+        img = Image.fromarray(arr, "RGBA")
+
+    return img, truth
+
+
+def make_weak_border_template(width=2670, height=1800, cols=5, rows=3, contrast=40, strong_rows=20):
+    """
+    A sheet whose cells only have a strong edge along their top strong_rows rows: the rest of each
+    cell is a flat gray just `contrast` levels below the white sheet. Canny only keeps those weak
+    sides by following them down from the strong top (hysteresis), across any strip seam.
+    Returns (RGBA image, cell rects in reading order).
+    """
+    cell = min(width / (cols + (cols + 1) * 0.1), height / (rows + (rows + 1) * 0.1 + 0.4))
+    gap = cell * 0.1
+    header = height - rows * cell - (rows + 1) * gap
+    x_start = (width - cols * cell - (cols - 1) * gap) / 2
+    gray = 255 - contrast
+
+    img = Image.new("RGBA", (width, height), (255, 255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    rects = []
+    for r in range(rows):
+        for c in range(cols):
+            x0 = round(x_start + c * (cell + gap))
+            y0 = round(header + r * (cell + gap))
+            x1 = round(x_start + c * (cell + gap) + cell)
+            y1 = round(header + r * (cell + gap) + cell)
+            draw.rectangle([x0, y0, x1 - 1, y1 - 1], fill=(gray, gray, gray, 255))
+            draw.rectangle([x0, y0, x1 - 1, y0 + strong_rows - 1], fill=(0, 0, 0, 255))
+            rects.append((x0, y0, x1 - x0, y1 - y0))
+    return img, rects
+
+
+def tiling_check(work_dir, memory_budget=4 * 2**20, contrasts=(40, 60)):
+    """
+    Detect weak-border sheets whole and in strips under memory_budget; the tiled contour
+    engine must find exactly the same rects. Returns [(contrast, untiled count, tiled count, same)].
+    """
+    results = []
+    for contrast in contrasts:
+        img, _ = make_weak_border_template(contrast=contrast)
+        path = os.path.join(work_dir, f"weak_border_{contrast}.png")
+        img.save(path)
+        found = []
+        for budget in (None, memory_budget):
+            _, cells = detect_emotes_with_rects(path, use_cache=False, use_registry=False, preview_size=(256, 256),
+                                                memory_budget=budget)
+            found.append([cell["rect"] for cell in cells])
+        results.append((contrast, len(found[0]), len(found[1]), found[0] == found[1]))
+    return results
+
+
+def _iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    ix = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    iy = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = ix * iy
+    union = aw * ah + bw * bh - inter
+    return inter / union if union else 0.0
+
+
+def score_detection(cell_infos, truth, min_iou=0.9):
+    """Compare detected cells against ground truth: recall, precision, fill accuracy and reading order"""
+    matched = []  # (truth index, detected index)
+    used = set()
+    for ti, t in enumerate(truth):
+        best, best_iou = None, min_iou
+        for di, cell in enumerate(cell_infos):
+            if di in used:
+                continue
+            iou = _iou(t["rect"], cell["rect"])
+            if iou >= best_iou:
+                best, best_iou = di, iou
+        if best is not None:
+            used.add(best)
+            matched.append((ti, best))
+
+    fill_correct = sum(1 for ti, di in matched if truth[ti]["filled"] == cell_infos[di]["has_content"])
+    detected_order = [ti for ti, di in sorted(matched, key=lambda m: m[1])]
+    return {
+        "recall": len(matched) / len(truth) if truth else 1.0,
+        "precision": len(matched) / len(cell_infos) if cell_infos else 1.0,
+        "fill_accuracy": fill_correct / len(matched) if matched else 0.0,
+        "order_correct": detected_order == sorted(detected_order),
+    }
+
+
+# Resamplers must stay this close to the PIL reference (PSNR in dB, per output size)
+PARITY_MIN_PSNR = 35.0
+
+
+def squared_error(a, b):
+    """Sum of squared differences of two RGBA images compared premultiplied, and the sample count"""
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    a[..., :3] *= a[..., 3:] / 255
+    b[..., :3] *= b[..., 3:] / 255
+    return float(((a - b) ** 2).sum()), a.size
+
+
+def psnr_from_error(total, count):
+    return float("inf") if total == 0 else float(10 * np.log10(255 ** 2 * count / total))
+
+
+def psnr(a, b):
+    """PSNR of two RGBA images compared premultiplied - what's visible once composited"""
+    return psnr_from_error(*squared_error(a, b))
+
+
+def resampler_parity(template, name_entries, platforms, resampler, reference="pil", padding=5):
+    """
+    PSNR per output size of resampler against reference, plus the time both take for all chains.
+    The error is pooled over every cell before taking the log - averaging per-cell PSNRs would let
+    one identical (infinite PSNR) cell hide any number of bad ones.
+    """
+    sizes = sorted({size for p in platforms for size in platform_sizes[p]}, reverse=True)
+    errors = {size: [0.0, 0] for size in sizes}
+    times = {reference: 0.0, resampler: 0.0}
+    for cell, _ in name_entries:
+        x, y, w, h = cell["rect"]
+        crop = template.rgba[y + padding:y + h - padding, x + padding:x + w - padding]
+        outputs = {}
+        for name in (reference, resampler):
+            start = time.perf_counter()
+            outputs[name] = RESAMPLERS[name](crop, sizes)
+            times[name] += time.perf_counter() - start
+        for size in sizes:
+            total, count = squared_error(outputs[reference][size], outputs[resampler][size])
+            errors[size][0] += total
+            errors[size][1] += count
+    return {
+        # Capped so identical output stays valid JSON
+        "psnr": {f"{w}x{h}": min(psnr_from_error(*errors[(w, h)]), 99.0) for (w, h) in sizes},
+        "chain_ms": times[resampler] * 1000,
+        "reference_chain_ms": times[reference] * 1000,
+    }
+
+
+def parity_check(resampler="opencv", reference="pil"):
+    """
+    Resample one fixed crop (first filled cell of the antialiased, lightly noisy seed-0 sheet)
+    to every platform size with both backends. Returns {size: PSNR}, and whether all pass.
+    """
+    img, truth = make_synthetic_template(antialias=True, noise=8.0, seed=0)
+    x, y, w, h = next(t["rect"] for t in truth if t["filled"])
+    crop = np.asarray(img)[y + 5:y + h - 5, x + 5:x + w - 5]
+    sizes = sorted({size for sizes in platform_sizes.values() for size in sizes}, reverse=True)
+    expected = RESAMPLERS[reference](crop, sizes)
+    actual = RESAMPLERS[resampler](crop, sizes)
+    scores = {f"{w}x{h}": psnr(expected[(w, h)], actual[(w, h)]) for (w, h) in sizes}
+    return scores, all(db >= PARITY_MIN_PSNR for db in scores.values())
+
+
+def _reset_peak_rss():
+    """Reset the kernel's high-water mark of this process (Linux), True if that worked"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _kernel_peak_rss():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    return None
+
+
+class PeakRss:
+    """
+    Peak resident memory while the block runs (bytes), and its growth over the RSS at the start.
+    Linux resets the kernel's high-water mark for the block; elsewhere RSS is sampled every few ms.
+    """
+
+    SAMPLE_INTERVAL = 0.005
+
+    def __enter__(self):
+        self.start = current_rss()
+        self.peak = self.start
+        self._kernel = self.start is not None and _reset_peak_rss()
+        self._stop = threading.Event()
+        self._sampler = None
+        if not self._kernel and self.start is not None:
+            self._sampler = threading.Thread(target=self._sample, daemon=True)
+            self._sampler.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.SAMPLE_INTERVAL):
+            self.peak = max(self.peak, current_rss() or 0)
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        if self._kernel:
+            self.peak = _kernel_peak_rss()
+        elif self.start is not None:
+            self.peak = max(self.peak, current_rss() or 0)
+        return False
+
+    @property
+    def growth(self):
+        if self.peak is None or self.start is None:
+            return None
+        return max(self.peak - self.start, 0)
+
+
+def run_case(work_dir, resolution, grid, fill_ratio, noise, antialias, engines, platforms, repeat, seed,
+             resamplers=("pil",)):
+    """Generate one synthetic sheet, benchmark every engine on it, then the export"""
+    width, height = resolution
+    cols, rows = grid
+    img, truth = make_synthetic_template(width, height, cols, rows, fill_ratio, noise, antialias, seed)
+    case_dir = os.path.join(work_dir, f"{width}x{height}_{cols}x{rows}_{fill_ratio}_{noise}_{int(antialias)}")
+    os.makedirs(case_dir, exist_ok=True)
+    path = os.path.join(case_dir, "sheet.png")
+    img.save(path, compress_level=1)
+    del img
+
+    case = {
+        "resolution": f"{width}x{height}", "grid": f"{cols}x{rows}", "fill_ratio": fill_ratio,
+        "noise": noise, "antialias": antialias, "detect": {}, "export": {}, "resample": {},
+    }
+
+    start = time.perf_counter()
+    template = load_template(path, use_cache=False)
+    case["decode_s"] = time.perf_counter() - start
+
+    best_cells = None
+    for engine in engines:
+        times = []
+        with PeakRss() as memory:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                _, cell_infos = detect_emotes_with_rects(template, use_cache=False, use_registry=False, engine=engine)
+                times.append(time.perf_counter() - start)
+        accuracy = score_detection(cell_infos, truth)
+        case["detect"][engine] = {
+            "best_s": min(times),
+            "mean_s": sum(times) / len(times),
+            "sheets_per_s": 1 / min(times),
+            "cells": len(cell_infos),
+            "accuracy": accuracy,
+            "peak_rss": memory.peak,
+            "rss_growth": memory.growth,
+        }
+        if best_cells is None and accuracy["recall"] == 1.0:
+            best_cells = cell_infos
+
+    # Fall back to the ground truth cells, so export numbers don't depend on detection quality
+    if best_cells is None:
+        best_cells = [
+            {"rect": t["rect"], "has_content": t["filled"], "id": i + 1} for i, t in enumerate(truth)
+        ]
+    name_entries = [(cell, "") for cell in best_cells if cell["has_content"]]
+    for resampler in resamplers:
+        times = []
+        files = 0
+        with PeakRss() as memory:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                files, out_dir = export_emotes(template, name_entries, platforms, resampler=resampler)
+                times.append(time.perf_counter() - start)
+                shutil.rmtree(out_dir, ignore_errors=True)
+        case["export"][resampler] = {
+            "platforms": list(platforms),
+            "emotes": len(name_entries),
+            "files": files,
+            "best_s": min(times),
+            "files_per_s": files / min(times) if min(times) else 0.0,
+            "peak_rss": memory.peak,
+            "rss_growth": memory.growth,
+        }
+        if resampler != "pil":
+            case["resample"][resampler] = resampler_parity(template, name_entries, platforms, resampler)
+    return case
+
+
+def compare(current, baseline):
+    """Print speed changes per case/engine against a previous run"""
+    old = {(c["resolution"], c["grid"], c["fill_ratio"], c["noise"], c["antialias"]): c for c in baseline["cases"]}
+    for case in current["cases"]:
+        key = (case["resolution"], case["grid"], case["fill_ratio"], case["noise"], case["antialias"])
+        prev = old.get(key)
+        if prev is None:
+            continue
+        label = f"{case['resolution']} {case['grid']}"
+        for engine, result in case["detect"].items():
+            if engine in prev["detect"]:
+                ratio = result["best_s"] / prev["detect"][engine]["best_s"]
+                print(f"  {label} detect[{engine}]: {ratio:.2f}x time")
+        for resampler, result in case["export"].items():
+            if resampler in prev["export"]:
+                ratio = result["best_s"] / prev["export"][resampler]["best_s"]
+                print(f"  {label} export[{resampler}]: {ratio:.2f}x time")
+
+
+def _size(text):
+    w, h = text.lower().split("x")
+    return int(w), int(h)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark detection and export on synthetic templates.")
+    parser.add_argument("--resolutions", nargs="+", type=_size, default=[(2670, 1800), (5340, 3600)])
+    parser.add_argument("--grids", nargs="+", type=_size, default=[(8, 5)])
+    parser.add_argument("--fill-ratios", nargs="+", type=float, default=[0.8])
+    parser.add_argument("--noise", nargs="+", type=float, default=[0.0])
+    parser.add_argument("--antialias", action="store_true", help="Render sheets with soft, antialiased edges")
+    parser.add_argument("--engines", nargs="+", default=sorted(DETECTION_ENGINES), choices=sorted(DETECTION_ENGINES))
+    parser.add_argument("--platforms", nargs="+", default=list(platform_sizes), choices=list(platform_sizes))
+    parser.add_argument("--resamplers", nargs="+", default=sorted(RESAMPLERS), choices=sorted(RESAMPLERS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON")
+    parser.add_argument("--compare", help="Previous JSON result to compare against")
+    parser.add_argument("--check-parity", action="store_true",
+                        help="Only check every non-PIL resampler against PIL on a fixed crop, then exit")
+    parser.add_argument("--check-tiling", action="store_true",
+                        help="Only check tiled (low memory) detection against whole-sheet detection, then exit")
+    args = parser.parse_args(argv)
+
+    if args.check_tiling:
+        work_dir = tempfile.mkdtemp(prefix="emote_bench_")
+        try:
+            results = tiling_check(work_dir)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        for contrast, untiled, tiled, same in results:
+            print(f"tiling[contrast {contrast}] {'ok' if same else 'FAILED'}: {untiled} cells whole, {tiled} tiled")
+        return 0 if all(same for *_, same in results) else 1
+
+    if args.check_parity:
+        failed = False
+        for resampler in args.resamplers:
+            if resampler == "pil":
+                continue
+            scores, ok = parity_check(resampler)
+            failed |= not ok
+            print(f"parity[{resampler}] {'ok' if ok else 'FAILED'} (min {PARITY_MIN_PSNR} dB): "
+                  + " ".join(f"{size} {db:.1f}" for size, db in scores.items()))
+        return 1 if failed else 0
+
+    results = {
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "cpus": os.cpu_count(),
+        "cases": [],
+    }
+    failed = False
+    work_dir = tempfile.mkdtemp(prefix="emote_bench_")
+    try:
+        for resolution in args.resolutions:
+            for grid in args.grids:
+                for fill_ratio in args.fill_ratios:
+                    for noise in args.noise:
+                        case = run_case(work_dir, resolution, grid, fill_ratio, noise, args.antialias,
+                                        args.engines, args.platforms, args.repeat, args.seed, args.resamplers)
+                        results["cases"].append(case)
+                        print(f"{case['resolution']} grid {case['grid']} fill {fill_ratio} noise {noise}:")
+                        for engine, r in case["detect"].items():
+                            acc = r["accuracy"]
+                            ok = acc["recall"] == 1.0 and acc["precision"] == 1.0 and acc["order_correct"]
+                            failed |= not ok
+                            print(f"  detect[{engine}]: {r['best_s'] * 1000:.1f} ms ({r['sheets_per_s']:.1f} sheets/s) "
+                                  f"recall {acc['recall']:.2f} precision {acc['precision']:.2f} "
+                                  f"fill {acc['fill_accuracy']:.2f} order {'ok' if acc['order_correct'] else 'WRONG'}, "
+                                  f"+{(r['rss_growth'] or 0) / 2**20:.0f} MiB RSS")
+                        for resampler, e in case["export"].items():
+                            print(f"  export[{resampler}]: {e['files']} files in {e['best_s'] * 1000:.1f} ms "
+                                  f"({e['files_per_s']:.0f} files/s), +{(e['rss_growth'] or 0) / 2**20:.0f} MiB RSS")
+                        for resampler, r in case["resample"].items():
+                            worst = min(r["psnr"].values())
+                            failed |= worst < PARITY_MIN_PSNR
+                            print(f"  resample[{resampler}]: {r['chain_ms']:.0f} ms vs pil {r['reference_chain_ms']:.0f} ms, "
+                                  f"PSNR " + " ".join(f"{size} {db:.1f}" for size, db in r["psnr"].items()))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
+        print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print(f"Compared to {args.compare}:")
+            compare(results, json.load(f))
+
+    # Non-zero exit when any engine missed or misordered cells, or a resampler lost parity with PIL
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
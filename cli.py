@@ -0,0 +1,313 @@
+"""
+Headless batch mode: detect and export many templates without the GUI.
+
+Usage:
+    python -m cli sheets/*.png --platforms twitch discord --workers 4
+    python cli.py drop_01/ --names names.csv
+
+Never imports customtkinter, so it runs on servers without a display.
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from core import (
+    DETECTION_ENGINES, ENCODING_PROFILES, EXPORT_TARGETS, RESAMPLERS, close_logging, detect_emotes_with_rects, export_emotes,
+    load_template, platform_sizes,
+)
+from animated import ANIMATED_FORMATS, export_animated_emotes
+from debug_writer import flush_debug_images
+from detection_cache import get_detection_cache
+from instrumentation import Trace
+
+
+# Animated sheets come as APNG, GIF or WebP
+TEMPLATE_EXTENSIONS = (".png", ".gif", ".webp")
+
+
+def expand_inputs(patterns):
+    """Turn a mix of files, folders and globs into a sorted list of template paths (PNG, GIF, WebP)"""
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = [p for ext in TEMPLATE_EXTENSIONS for p in glob.glob(os.path.join(pattern, "*" + ext))]
+        else:
+            matches = glob.glob(pattern) or [pattern]
+        for path in matches:
+            if path.lower().endswith(TEMPLATE_EXTENSIONS) and path not in paths:
+                paths.append(path)
+    return sorted(paths)
+
+
+def parse_names(data):
+    """Names from parsed JSON: a list of names in id order, or an object {"1": "hype", ...}"""
+    if isinstance(data, list):
+        return {i + 1: str(name) for i, name in enumerate(data)}
+    return {int(k): str(v) for k, v in data.items()}
+
+
+def load_names(sidecar_path):
+    """
+    Read emote names from a CSV or JSON sidecar.
+    Returns a dict mapping emote id (int) -> name.
+
+    JSON: either a list of names in id order, or an object {"1": "hype", ...}
+    CSV: rows of "id,name" (a header row is skipped if the id isn't a number)
+    """
+    if sidecar_path.lower().endswith(".json"):
+        with open(sidecar_path, encoding="utf-8") as f:
+            return parse_names(json.load(f))
+
+    names = {}
+    with open(sidecar_path, newline="", encoding="utf-8") as f:
+        for row in csv.reader(f):
+            if len(row) < 2 or not row[0].strip().isdigit():
+                continue
+            names[int(row[0])] = row[1]
+    return names
+
+
+def find_sidecar(template_path):
+    """Look for template.names.json / template.names.csv next to the template"""
+    stem = os.path.splitext(template_path)[0]
+    for ext in (".names.json", ".names.csv"):
+        if os.path.isfile(stem + ext):
+            return stem + ext
+    return None
+
+
+def megabytes(value):
+    """--memory-budget in MB -> bytes, None stays None"""
+    return None if value is None else int(value * 2**20)
+
+
+def process_template(path, platforms, names_path=None, debug_enabled=False, use_cache=True, engine="contours",
+                     trace_mode=None, encoding="balanced", write_report=False, target="folder", incremental=True,
+                     output_dir=None, animated_format="gif", resampler="pil", memory_budget=None):
+    """
+    Run detection + export for one template. Executed inside a worker process.
+    trace_mode "time" or "memory" writes a Chrome trace next to the template.
+    write_report saves bytes and encode time per file as <template>.export.json.
+    target is "folder", "zip" or "platform_zips" (see core.export_emotes).
+    incremental skips files whose inputs are unchanged since the last export into the same folder.
+    output_dir overrides the export location (see core.export_emotes).
+    Animated templates export animated_format ("gif" or "webp") files; target doesn't apply to them.
+    resampler picks the resize backend ("pil" or "opencv", see core.RESAMPLERS).
+    memory_budget (bytes) makes detection of huge sheets run in strips (see core.detect_emotes_with_rects).
+    """
+    cache = get_detection_cache() if use_cache else None
+    hits_before = cache.hits if cache is not None else 0
+    trace = Trace(memory=trace_mode == "memory") if trace_mode else None
+
+    start = time.perf_counter()
+    # Decode once, detection and export share the same buffer
+    template = load_template(path, use_cache=False, trace=trace)
+    # The preview is never shown here - a thumbnail spares a full-size copy of the sheet
+    _, cell_infos = detect_emotes_with_rects(template, debug_enabled, use_cache=use_cache, engine=engine, trace=trace,
+                                             preview_size=(256, 256), memory_budget=memory_budget)
+    detect_time = time.perf_counter() - start
+    cache_hit = cache is not None and cache.hits > hits_before
+
+    sidecar = names_path or find_sidecar(path)
+    names = load_names(sidecar) if sidecar else {}
+
+    name_entries = [(cell, names.get(cell["id"], "")) for cell in cell_infos if cell["has_content"]]
+    report = []
+    if template.frame_count > 1:
+        exported_count, out_dir = export_animated_emotes(
+            template, name_entries, platforms, animated_format, debug_enabled, trace=trace, report=report,
+            output_dir=output_dir, resampler=resampler,
+        )
+    else:
+        exported_count, out_dir = export_emotes(
+            template, name_entries, platforms, debug_enabled, trace=trace, encoding=encoding, report=report,
+            target=target, incremental=incremental, output_dir=output_dir, resampler=resampler,
+        )
+    total_time = time.perf_counter() - start
+
+    if debug_enabled:
+        # Worker processes skip atexit handlers - make sure the debug images are written
+        flush_debug_images()
+        close_logging()
+
+    trace_path = None
+    if trace is not None:
+        trace_path = os.path.splitext(path)[0] + ".trace.json"
+        trace.save_chrome_trace(trace_path)
+
+    written = [r for r in report if r["status"] == "written"]
+    report_path = None
+    if write_report:
+        report_path = os.path.splitext(path)[0] + ".export.json"
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(sorted(report, key=lambda r: r["file"]), f, indent=1)
+
+    return {
+        "path": path,
+        "cells": len(cell_infos),
+        "frames": template.frame_count,
+        "emotes": len(name_entries),
+        "files": exported_count,
+        "out_dir": out_dir,
+        "cache_hit": cache_hit,
+        "trace_path": trace_path,
+        "report_path": report_path,
+        "written": len(written),
+        "skipped": sum(1 for r in report if r["status"] == "skipped"),
+        "deleted": sum(1 for r in report if r["status"] == "deleted"),
+        "bytes": sum(r["bytes"] for r in written),
+        "encode_time": sum(r["encode_ms"] for r in written) / 1000,
+        "over_budget": [r["file"] for r in report if r.get("over_budget")],
+        "detect_time": detect_time,
+        "export_time": total_time - detect_time,
+        "total_time": total_time,
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="cli",
+        description="Detect and export emotes from PNG templates without the GUI.",
+    )
+    parser.add_argument("inputs", nargs="*", help="PNG/GIF/WebP files, folders or glob patterns")
+    parser.add_argument(
+        "-p", "--platforms", nargs="+", default=["twitch"],
+        choices=sorted(platform_sizes), help="Platforms to export (default: twitch)",
+    )
+    parser.add_argument(
+        "-w", "--workers", type=int, default=os.cpu_count() or 1,
+        help="Number of worker processes (default: CPU count)",
+    )
+    parser.add_argument(
+        "-n", "--names",
+        help="CSV/JSON with emote names, used for every template "
+             "(default: <template>.names.json/.csv next to each file)",
+    )
+    parser.add_argument(
+        "-e", "--engine", default="contours", choices=sorted(DETECTION_ENGINES),
+        help="Rect finding engine for unknown layouts (default: contours; pyramid for very large sheets, grid for regular grids)",
+    )
+    parser.add_argument(
+        "--encoding", default="balanced", choices=list(ENCODING_PROFILES),
+        help="PNG encoding profile: fast, balanced (default) or max (smallest files, slower)",
+    )
+    parser.add_argument(
+        "-t", "--target", default="folder", choices=EXPORT_TARGETS,
+        help="Write loose PNGs (folder, default), one ZIP (zip) or one ZIP per platform (platform_zips)",
+    )
+    parser.add_argument(
+        "--animated-format", default="gif", choices=ANIMATED_FORMATS,
+        help="Output format for animated templates (default: gif)",
+    )
+    parser.add_argument(
+        "--resampler", default="pil", choices=sorted(RESAMPLERS),
+        help="Resize backend: pil (LANCZOS reference, default) or opencv (batched, about 3x faster resizing)",
+    )
+    parser.add_argument(
+        "--memory-budget", type=float, metavar="MB",
+        help="Detect sheets whose edge pipeline needs more than this in overlapping strips (same results, less memory)",
+    )
+    parser.add_argument("--full", action="store_true", help="Re-encode every file, even if unchanged since the last export")
+    parser.add_argument("--report", action="store_true", help="Write bytes and encode time per file to <template>.export.json")
+    parser.add_argument("--debug", action="store_true", help="Write debug logs and images")
+    parser.add_argument("--trace", action="store_true", help="Write a Chrome trace (<template>.trace.json) with per-stage timings")
+    parser.add_argument("--trace-memory", action="store_true", help="Like --trace, plus allocation peaks per stage (slower: exports on one thread)")
+    parser.add_argument("--no-cache", action="store_true", help="Always run detection, ignore the detection cache")
+    parser.add_argument("--clear-cache", action="store_true", help="Empty the detection cache before processing")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.clear_cache:
+        cache = get_detection_cache()
+        if cache is not None:
+            cache.clear()
+            print(f"Cleared detection cache: {cache.path}")
+        if not args.inputs:
+            return 0
+    if not args.inputs:
+        parser.error("no input templates given")
+
+    paths = expand_inputs(args.inputs)
+    if not paths:
+        print("No templates found.", file=sys.stderr)
+        return 1
+
+    workers = max(1, min(args.workers, len(paths)))
+    print(f"Processing {len(paths)} template(s) with {workers} worker(s)...")
+
+    options = {
+        "platforms": args.platforms,
+        "names_path": args.names,
+        "debug_enabled": args.debug,
+        "use_cache": not args.no_cache,
+        "engine": args.engine,
+        "trace_mode": "memory" if args.trace_memory else "time" if args.trace else None,
+        "encoding": args.encoding,
+        "write_report": args.report,
+        "target": args.target,
+        "incremental": not args.full,
+        "animated_format": args.animated_format,
+        "resampler": args.resampler,
+        "memory_budget": megabytes(args.memory_budget),
+    }
+    results = []
+    failures = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(process_template, path, **options): path for path in paths}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                r = future.result()
+            except Exception as e:
+                failures.append(path)
+                print(f"FAILED {path}: {e}", file=sys.stderr)
+                continue
+            results.append(r)
+            rate = r["files"] / r["total_time"] if r["total_time"] else 0.0
+            print(
+                f"{os.path.basename(path)}: {r['emotes']}/{r['cells']} emotes, {r['files']} files "
+                f"in {r['total_time']:.2f}s (detect {r['detect_time']:.2f}s{' cached' if r['cache_hit'] else ''}, "
+                f"export {r['export_time']:.2f}s, {rate:.1f} files/s)"
+            )
+            print(
+                f"  {r['written']} rewritten, {r['skipped']} unchanged, {r['deleted']} deleted - "
+                f"{r['bytes'] / 1024:.1f} KiB written, encode {r['encode_time']:.2f}s"
+            )
+            for filename in r["over_budget"]:
+                print(f"  WARNING {filename} is over its platform size limit", file=sys.stderr)
+            if r["report_path"]:
+                print(f"  report: {r['report_path']}")
+            if r["trace_path"]:
+                print(f"  trace: {r['trace_path']}")
+    wall = time.perf_counter() - start
+
+    # === Summary ===
+    total_files = sum(r["files"] for r in results)
+    total_emotes = sum(r["emotes"] for r in results)
+    total_bytes = sum(r["bytes"] for r in results)
+    cache_hits = sum(1 for r in results if r["cache_hit"])
+    print(
+        f"\nDone: {len(results)} template(s), {total_emotes} emotes, {total_files} files "
+        f"in {wall:.2f}s ({len(results) / wall:.2f} sheets/s, {total_files / wall:.1f} files/s), "
+        f"{total_bytes / 1024:.1f} KiB"
+    )
+    if not args.no_cache:
+        print(f"Detection cache: {cache_hits} hit(s), {len(results) - cache_hits} miss(es)")
+    if failures:
+        print(f"{len(failures)} template(s) failed.", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
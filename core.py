@@ -2,7 +2,86 @@ from PIL import Image, ImageDraw
 import cv2
 import numpy as np
 import os
+import io
+import hashlib
+import json
 import logging
+import time
+import tempfile
+import zipfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from detection_cache import get_detection_cache, make_key
+from template_registry import get_template_registry
+from instrumentation import stage
+from debug_writer import queue_debug_image
+
+
+# Bump when detection output changes, so stale cached detections are ignored
+DETECTION_VERSION = 2
+
+# Pyramid engine: long side of the downscaled copy rects are searched on
+PYRAMID_MAX_SIDE = 1024
+# The contour engine's 15000px minimum cell area, as a fraction of the shipped 2670x1800 templates
+MIN_CELL_AREA_FRACTION = 15000 / (2670 * 1800)
+
+# Tiled contour detection (detect_emotes_with_rects(memory_budget=...)), working memory in bytes per pixel:
+# the whole-sheet edge pipeline (all stages kept), one strip of it (stages freed as it goes),
+# hysteresis labelling of a band, findContours on the unpacked closed map,
+# the content check's summed-area pass and PIL's reduce()
+EDGE_PIPELINE_BYTES_PER_PIXEL = 12
+EDGE_STRIP_BYTES_PER_PIXEL = 6
+LINK_BYTES_PER_PIXEL = 6
+CONTOUR_BYTES_PER_PIXEL = 3
+CONTENT_CHECK_BYTES_PER_PIXEL = 8
+PREVIEW_BYTES_PER_PIXEL = 4
+# Rows added above and below every strip - blur + Canny's gradients, and the 2+2 morphology passes,
+# reach under 10px, so rows further inside come out exactly as on the whole sheet
+TILE_HALO = 32
+
+# Platform size requirements
+platform_sizes = {
+    "twitch": [(112, 112), (56, 56), (28, 28)],
+    "twitchbages": [(72, 72), (36, 36), (18, 18)],
+    "discord": [(128, 128),(64, 64), (32, 32)],
+    "youtube": [ (48, 48), (24, 24)],
+    "kick": [(128, 128), (64, 64), (32, 32)]
+}
+
+
+# PNG encoding profiles for export_emotes(encoding=...)
+# quantize_tolerance: max per-channel error allowed for a palette (P mode) PNG, None = never palette
+ENCODING_PROFILES = {
+    "fast": {"compress_level": 1, "optimize": False, "quantize_tolerance": None},
+    "balanced": {"compress_level": 6, "optimize": False, "quantize_tolerance": None},
+    "max": {"compress_level": 9, "optimize": True, "quantize_tolerance": 0},
+}
+
+# Upload limits in bytes - a file over budget triggers a search for a smaller encoding
+platform_byte_budgets = {
+    "twitch": 1024 * 1024,
+    "twitchbages": 25 * 1024,
+    "discord": 256 * 1024,
+    "youtube": 1024 * 1024,
+    "kick": 1024 * 1024,
+}
+
+# Where export_emotes puts the PNGs
+EXPORT_TARGETS = ("folder", "zip", "platform_zips")
+
+# Incremental re-export: one manifest per source template, kept in the export folder
+# (<template stem>.export_manifest.json). Bump EXPORT_VERSION whenever crop/resize/encode
+# changes its output, so old manifests are ignored.
+MANIFEST_SUFFIX = ".export_manifest.json"
+EXPORT_VERSION = 1
+
+# Palette sizes tried, in order, when a file is over budget
+BUDGET_PALETTE_STEPS = (256, 128, 64, 32, 16)
+# Max per-channel error a budget palette may add - lossier ones are never shipped,
+# the file is reported over budget instead (emote art stays around 20-30 down to 32 colors)
+BUDGET_MAX_ERROR = 32
 
 
 def setup_logging(filename):
@@ -24,8 +103,8 @@ def setup_logging(filename):
     logger = logging.getLogger("emote_debug")
     logger.setLevel(logging.DEBUG)
     
-    # Clear old handlers to avoid duplicate logs if function is called multiple times
-    logger.handlers.clear()
+    # Close old handlers to avoid duplicate logs (and leaked files) if function is called multiple times
+    close_logging(logger)
     
     # Create file handler - writes to debug.log
     file_handler = logging.FileHandler(log_path, mode='w')
@@ -40,55 +119,238 @@ def setup_logging(filename):
     
     return logger, debug_dir
 
+def close_logging(logger=None):
+    """Flush and close every handler of the debug logger - long-running callers do this after each template"""
+    logger = logger or logging.getLogger("emote_debug")
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+
+
 def save_debug_image(debug_dir, filename, image, logger):
     """
     Helper function to save debug images.
-    Handles both OpenCV (numpy) and PIL images.
+    Handles both OpenCV (numpy) and PIL images, or a callable that draws one.
+    Writing happens on the background debug writer (see debug_writer for format/stage settings).
     """
-    path = os.path.join(debug_dir, filename)
-    
-    if isinstance(image, np.ndarray):
-        cv2.imwrite(path, image)
+    return queue_debug_image(debug_dir, filename, image, logger)
+
+
+class LoadedTemplate:
+    """
+    A template decoded once and shared between detection and export.
+    Holds a single RGBA buffer; every other view is derived from it.
+    """
+
+    def __init__(self, path, trace=None):
+        self.path = path
+        stat = os.stat(path)
+        self.mtime = stat.st_mtime
+        self.file_size = stat.st_size
+        # Read the file once: hash the bytes for the detection cache, then decode them
+        with stage(trace, "read", bytes=self.file_size):
+            with open(path, "rb") as f:
+                data = f.read()
+            self.content_hash = hashlib.blake2b(data, digest_size=20).hexdigest()
+        with stage(trace, "decode"):
+            with Image.open(io.BytesIO(data)) as src:
+                # Animated sheets (APNG/GIF/WebP): the first frame is the reference for detection
+                self.frame_count = getattr(src, "n_frames", 1)
+                # One owned RGBA buffer - the PIL image below shares this memory
+                self.rgba = np.array(src.convert("RGBA"))
+        del data
+        self._gray = None
+
+    @property
+    def width(self):
+        return self.rgba.shape[1]
+
+    @property
+    def height(self):
+        return self.rgba.shape[0]
+
+    @property
+    def nbytes(self):
+        return self.rgba.nbytes
+
+    @property
+    def image(self):
+        """Read-only PIL view of the RGBA buffer (zero-copy, drawing on it makes a copy)"""
+        return Image.frombuffer("RGBA", (self.width, self.height), self.rgba, "raw", "RGBA", 0, 1)
+
+    @property
+    def bgr(self):
+        """Zero-copy BGR view for OpenCV (strided - use .copy() before drawing on it)"""
+        return self.rgba[:, :, 2::-1]
+
+    @property
+    def gray(self):
+        """Grayscale image for edge detection, computed once"""
+        if self._gray is None:
+            self._gray = cv2.cvtColor(self.rgba, cv2.COLOR_RGBA2GRAY)
+        return self._gray
+
+
+# Small LRU of decoded templates so the GUI's detect -> export round trip decodes once
+_template_cache = OrderedDict()
+_template_cache_lock = threading.Lock()
+TEMPLATE_CACHE_MAX_ENTRIES = 2
+TEMPLATE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+
+def _template_key(path):
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_mtime, stat.st_size)
+
+
+def is_template_cached(path):
+    """True if load_template(path) would reuse a cached decode"""
+    key = _template_key(path)
+    with _template_cache_lock:
+        return key in _template_cache
+
+
+def load_template(path, use_cache=True, trace=None):
+    """Return a LoadedTemplate for path, reusing a cached decode if the file hasn't changed"""
+    if not use_cache:
+        return LoadedTemplate(path, trace)
+
+    key = _template_key(path)
+    with _template_cache_lock:
+        template = _template_cache.get(key)
+        if template is not None:
+            _template_cache.move_to_end(key)
+            return template
+
+    template = LoadedTemplate(path, trace)
+
+    with _template_cache_lock:
+        _template_cache[key] = template
+        _template_cache.move_to_end(key)
+        # Evict oldest entries until both limits hold (always keep the newest one)
+        while len(_template_cache) > 1 and (
+            len(_template_cache) > TEMPLATE_CACHE_MAX_ENTRIES
+            or sum(t.nbytes for t in _template_cache.values()) > TEMPLATE_CACHE_MAX_BYTES
+        ):
+            _template_cache.popitem(last=False)
+    return template
+
+
+def clear_template_cache():
+    """Drop all cached decoded templates"""
+    with _template_cache_lock:
+        _template_cache.clear()
+
+
+def _as_template(source, trace=None):
+    """Accept either a filename or an already loaded template"""
+    if isinstance(source, LoadedTemplate):
+        return source
+    return load_template(source, trace=trace)
+
+
+def _bright_mask(rgba, brightness_threshold):
+    """uint8 mask of the pixels that count as content"""
+    # mean(rgb) > t  is the same as  sum(rgb) > 3t, and stays in integers
+    # (channel-by-channel adds are much faster than .sum(axis=2) on the interleaved buffer)
+    rgb_sum = rgba[:, :, 0].astype(np.uint16)
+    rgb_sum += rgba[:, :, 1]
+    rgb_sum += rgba[:, :, 2]
+    # Fully transparent pixels are never content, whatever color they carry
+    # (the old template's empty cells hold the background color at alpha 0)
+    return ((rgb_sum > 3 * brightness_threshold) & (rgba[:, :, 3] > 0)).astype(np.uint8)
+
+
+def cell_fill_fractions(source, rects, brightness_threshold=15, memory_budget=None):
+    """
+    Fraction of bright pixels inside each rect, for all rects in one vectorized pass.
+    A pixel is bright when it is not fully transparent and the average of its
+    RGB channels is above brightness_threshold.
+    If the whole-sheet pass would not fit memory_budget bytes, rects are counted one by one.
+    """
+    template = _as_template(source)
+    if len(rects) == 0:
+        return np.zeros(0, dtype=np.float64)
+
+    r = np.asarray(rects, dtype=np.int64)
+    x0 = np.clip(r[:, 0], 0, template.width)
+    y0 = np.clip(r[:, 1], 0, template.height)
+    x1 = np.clip(r[:, 0] + r[:, 2], 0, template.width)
+    y1 = np.clip(r[:, 1] + r[:, 3], 0, template.height)
+
+    if memory_budget is not None and template.width * template.height * CONTENT_CHECK_BYTES_PER_PIXEL > memory_budget:
+        counts = np.array([
+            np.count_nonzero(_bright_mask(template.rgba[top:bottom, left:right], brightness_threshold))
+            for left, top, right, bottom in zip(x0, y0, x1, y1)
+        ], dtype=np.int64)
     else:
-        image.save(path)
-    
-    logger.debug(f"Saved debug image: {filename}")
+        # Summed-area table: sat[y, x] = bright pixels above and left of (x, y)
+        sat = cv2.integral(_bright_mask(template.rgba, brightness_threshold), sdepth=cv2.CV_32S)
+        counts = sat[y1, x1] - sat[y0, x1] - sat[y1, x0] + sat[y0, x0]
+    return counts / (r[:, 2] * r[:, 3]).astype(np.float64)
 
 
-def detect_emotes_with_rects(filename, debug_enabled=False):
-    """Detect rectangles, number filled ones, return marked image + cell data"""
-    
-    # Optional debug logging for bug reports
-    logger = None
-    debug_dir = None
-    if debug_enabled:
-        logger, debug_dir = setup_logging(filename)
-        logger.info("=== EMOTE DETECTION STARTED ===")
-        logger.info(f"Input file: {filename}")
-    
+def classify_cells(rects, fills, min_fraction=0.03):
+    """
+    Build cell_infos from rects and their fill fractions.
+    Filled cells are numbered in reading order - call again with a different
+    min_fraction to re-tune a sheet without re-running detection.
+    """
+    cell_infos = []
+    filled_count = 1
+    for rect, fill in zip(rects, fills):
+        # If 3%+ of pixels are bright, cell has content
+        if fill >= min_fraction:
+            cell_infos.append({"rect": tuple(rect), "has_content": True, "id": filled_count, "fill": float(fill)})
+            filled_count += 1
+        else:
+            cell_infos.append({"rect": tuple(rect), "has_content": False, "fill": float(fill)})
+    return cell_infos
+
+
+def _cell_rect(cnt):
+    """Bounding rect of a contour that looks like an emote cell, else None"""
+    area = cv2.contourArea(cnt)
+    # Filter by minimum size - emote cells are expected to be reasonably large
+    if area < 15000:
+        return None
+    x, y, w, h = cv2.boundingRect(cnt)
+    aspect = w / float(h)
+    # Filter by aspect ratio - emote cells are roughly square (0.7-1.4 allows slight rectangles)
+    if 0.7 < aspect < 1.4:
+        return (x, y, w, h)
+    return None
+
+
+def _contour_rects(template, debug_enabled=False, logger=None, debug_dir=None, trace=None):
+    """Run the edge pipeline at full resolution and return the grid cell rects in reading order"""
     # === STEP 1: Edge Detection Pipeline ===
     # Using OpenCV to find rectangle boundaries in the emote grid
-    img = cv2.imread(filename, cv2.IMREAD_COLOR)
+    # The template is decoded once; OpenCV works on views of the shared buffer
+    img = template.bgr
     
     if debug_enabled:
-        logger.info(f"Image loaded - Size: {img.shape[1]}x{img.shape[0]} pixels")
+        logger.info(f"Image loaded - Size: {template.width}x{template.height} pixels")
         save_debug_image(debug_dir, "01_original.png", img, logger)
     # Convert to grayscale - edges are easier to detect without color noise
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    with stage(trace, "gray"):
+        gray = template.gray
 
     # Look at the greyscaled Image
     if debug_enabled:
         save_debug_image(debug_dir, "02_grayscale.png", gray, logger)
 
     # Blur reduces noise that would create false edges
-    blur = cv2.GaussianBlur(gray, (5, 5), 0)
+    with stage(trace, "blur"):
+        blur = cv2.GaussianBlur(gray, (5, 5), 0)
 
     # Look at the blured Image
     if debug_enabled:
         save_debug_image(debug_dir, "03_blurred.png", blur, logger)
 
     # Canny finds edges by detecting brightness gradients
-    edges = cv2.Canny(blur, 40, 120)
+    with stage(trace, "canny"):
+        edges = cv2.Canny(blur, 40, 120)
 
     # Look at cannied Imagaes
     if debug_enabled:
@@ -96,13 +358,15 @@ def detect_emotes_with_rects(filename, debug_enabled=False):
 
     # Morphological operations close gaps in rectangle borders
     kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (5, 5))
-    dilated = cv2.dilate(edges, kernel, iterations=2) # Expand edges to connect gaps
+    with stage(trace, "dilate"):
+        dilated = cv2.dilate(edges, kernel, iterations=2) # Expand edges to connect gaps
     
     # Dialated Image
     if debug_enabled:
         save_debug_image(debug_dir, "05_dilated.png", dilated, logger)
 
-    closed = cv2.erode(dilated, kernel, iterations=2) # Shrink back to original size
+    with stage(trace, "erode"):
+        closed = cv2.erode(dilated, kernel, iterations=2) # Shrink back to original size
     
     if debug_enabled:
         save_debug_image(debug_dir, "06_closed_final.png", closed, logger)
@@ -110,25 +374,20 @@ def detect_emotes_with_rects(filename, debug_enabled=False):
 
     # === STEP 2: Find and Filter Rectangles ===
     # Extract contours (connected edge regions) from the processed image
-    contours, _ = cv2.findContours(closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    with stage(trace, "contours"):
+        contours, _ = cv2.findContours(closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     
     if debug_enabled:
         logger.info(f"Found {len(contours)} total contours")
-        contour_debug = img.copy()
-        cv2.drawContours(contour_debug, contours, -1, (0, 255, 255), 2)
-        save_debug_image(debug_dir, "07_all_contours.png", contour_debug, logger)
+
+        def draw_contours():
+            # Runs on the debug writer thread - the copy never blocks detection
+            contour_debug = img.copy()
+            cv2.drawContours(contour_debug, contours, -1, (0, 255, 255), 2)
+            return contour_debug
+        save_debug_image(debug_dir, "07_all_contours.png", draw_contours, logger)
     
-    rects = []
-    for cnt in contours:
-        area = cv2.contourArea(cnt)
-        # Filter by minimum size - emote cells are expected to be reasonably large
-        if area < 15000:
-            continue
-        x, y, w, h = cv2.boundingRect(cnt)
-        aspect = w / float(h)
-        # Filter by aspect ratio - emote cells are roughly square (0.7-1.4 allows slight rectangles)
-        if 0.7 < aspect < 1.4:
-            rects.append((x, y, w, h))
+    rects = [rect for rect in map(_cell_rect, contours) if rect is not None]
     
     # Sort rectangles top-to-bottom, left-to-right (reading order)
     # Dividing y by 100 groups rectangles into rows
@@ -136,67 +395,869 @@ def detect_emotes_with_rects(filename, debug_enabled=False):
     
     if debug_enabled:
         logger.info(f"Filtered to {len(rects)} valid rectangles (area > 15000, aspect ratio 0.7-1.4)")
-        rect_debug = img.copy()
-        for (x, y, w, h) in rects:
-            cv2.rectangle(rect_debug, (x, y), (x+w, y+h), (0, 255, 0), 3)
-        save_debug_image(debug_dir, "08_accepted_rectangles.png", rect_debug, logger)
-
-    # === STEP 3: Analyze Cell Content ===
-    # Switch to PIL for easier image manipulation and drawing
-    pil_img = Image.open(filename).convert("RGBA")
-    draw = ImageDraw.Draw(pil_img)
-
-    def has_content(rgba_crop, brightness_threshold=15, min_fraction=0.03):
-        """Check if cell contains emote by measuring bright pixel percentage"""
-        arr = np.array(rgba_crop)
-        rgb = arr[:, :, :3]
-        # Calculate brightness (average of RGB channels)
-        brightness = rgb.mean(axis=2)
-        # Count pixels above threshold
-        bright_mask = brightness > brightness_threshold
-        frac = np.count_nonzero(bright_mask) / float(bright_mask.size)
-        # If 3%+ of pixels are bright, cell has content
-        return frac >= min_fraction
 
-    # === STEP 4: Mark Cells and Number Filled Ones ===
-    cell_infos = []
-    filled_count = 1
-    for (x, y, w, h) in rects:
-        full_cell = pil_img.crop((x, y, x + w, y + h))
-        filled = has_content(full_cell)
-        
-        if filled:
+        def draw_rects(accepted=list(rects)):
+            rect_debug = img.copy()
+            for (x, y, w, h) in accepted:
+                cv2.rectangle(rect_debug, (x, y), (x+w, y+h), (0, 255, 0), 3)
+            return rect_debug
+        save_debug_image(debug_dir, "08_accepted_rectangles.png", draw_rects, logger)
+
+    return rects
+
+
+def _edge_candidates(rgba):
+    """
+    Canny's two hysteresis inputs for a block of rows, as _contour_rects' gray -> blur -> Canny(40, 120)
+    sees them: every non-max-suppressed edge pixel over the low threshold, and those over the high one.
+    Canny with equal thresholds skips hysteresis, so neither map depends on rows outside the block.
+    """
+    gray = cv2.cvtColor(rgba, cv2.COLOR_RGBA2GRAY)
+    blur = cv2.GaussianBlur(gray, (5, 5), 0)
+    del gray
+    weak = cv2.Canny(blur, 40, 40)
+    strong = cv2.Canny(blur, 120, 120)
+    return weak, strong
+
+
+def _packed_edge_candidates(template, rows, trace=None):
+    """
+    Run _edge_candidates over the sheet in strips of `rows` rows (+ TILE_HALO above and below)
+    and keep both maps bit-packed (1 bit per pixel each).
+    Strips are views of the decoded buffer; each strip's intermediates are freed before the next.
+    """
+    width, height = template.width, template.height
+    weak = np.empty((height, (width + 7) // 8), dtype=np.uint8)
+    strong = np.empty_like(weak)
+    for top in range(0, height, rows):
+        bottom = min(top + rows, height)
+        win_top = max(top - TILE_HALO, 0)
+        win_bottom = min(bottom + TILE_HALO, height)
+        with stage(trace, "edge_strip", rows=f"{top}-{bottom}"):
+            strip_weak, strip_strong = _edge_candidates(template.rgba[win_top:win_bottom])
+            weak[top:bottom] = np.packbits(strip_weak[top - win_top:bottom - win_top], axis=1)
+            strong[top:bottom] = np.packbits(strip_strong[top - win_top:bottom - win_top], axis=1)
+            del strip_weak, strip_strong
+    return weak, strong
+
+
+def _link_packed_edges(weak, strong, width, band, trace=None):
+    """
+    Canny's hysteresis over the whole sheet, one band of rows at a time: keep the weak edge
+    components (8-connected) holding a strong pixel anywhere - a cell border that is only strong
+    at its top still survives in the bands below. Components are labelled per band and joined
+    across band seams (union-find over all bands' labels), then a second pass writes the kept
+    pixels over weak, which ends up as Canny(40, 120)'s edge map, bit-packed.
+    """
+    height = weak.shape[0]
+    parent = []
+    seeds = []
+    offsets = []
+
+    def find(label):
+        while parent[label] != label:
+            parent[label] = parent[parent[label]]
+            label = parent[label]
+        return label
+
+    above = None
+    for top in range(0, height, band):
+        with stage(trace, "link_band", rows=f"{top}-{min(top + band, height)}"):
+            edges = np.unpackbits(weak[top:top + band], axis=1, count=width)
+            count, labels = cv2.connectedComponents(edges, connectivity=8, ltype=cv2.CV_32S)
+            del edges
+            # Global label = band offset + local label; each band's background (0) is never joined
+            offset = len(parent)
+            offsets.append(offset)
+            parent.extend(range(offset, offset + count))
+            strong_edges = np.unpackbits(strong[top:top + band], axis=1, count=width)
+            found = np.unique(labels[strong_edges > 0])
+            seeds.append(found[found > 0] + offset)
+            del strong_edges
+
+            below = labels[0] + offset
+            if above is not None:
+                # 8-connectivity across the seam: every pixel touches the three under it
+                pairs = []
+                for shift in (-1, 0, 1):
+                    a = above[max(-shift, 0):width - max(shift, 0)]
+                    b = below[max(shift, 0):width - max(-shift, 0)]
+                    linked = (a != offsets[-2]) & (b != offset)
+                    pairs.append(np.stack([a[linked], b[linked]], axis=1))
+                for a, b in np.unique(np.concatenate(pairs), axis=0):
+                    root_a, root_b = find(int(a)), find(int(b))
+                    if root_a != root_b:
+                        parent[root_a] = root_b
+            above = labels[-1] + offset
+            del labels
+
+    roots = np.array(parent, dtype=np.int64)
+    while True:
+        jumped = roots[roots]
+        if np.array_equal(jumped, roots):
+            break
+        roots = jumped
+    strong_roots = np.zeros(len(parent), dtype=bool)
+    strong_roots[roots[np.concatenate(seeds)]] = True
+    keep = strong_roots[roots]
+
+    # Same bands again (connectedComponents labels them exactly as before), clearing the dropped components
+    offsets.append(len(parent))
+    for i, top in enumerate(range(0, height, band)):
+        band_keep = keep[offsets[i]:offsets[i + 1]]
+        band_keep[0] = False
+        if band_keep[1:].all():
+            continue
+        with stage(trace, "link_band", rows=f"{top}-{min(top + band, height)}"):
+            edges = np.unpackbits(weak[top:top + band], axis=1, count=width)
+            _, labels = cv2.connectedComponents(edges, connectivity=8, ltype=cv2.CV_32S)
+            del edges
+            weak[top:top + band] = np.packbits(band_keep[labels], axis=1)
+            del labels
+
+
+def _packed_closed_map(edges, width, rows, trace=None):
+    """_contour_rects' dilate -> erode closing of the packed edge map, in strips of `rows` rows (+ TILE_HALO)"""
+    height = edges.shape[0]
+    closed = np.empty_like(edges)
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (5, 5))
+    for top in range(0, height, rows):
+        bottom = min(top + rows, height)
+        win_top = max(top - TILE_HALO, 0)
+        win_bottom = min(bottom + TILE_HALO, height)
+        with stage(trace, "close_strip", rows=f"{top}-{bottom}"):
+            strip = np.unpackbits(edges[win_top:win_bottom], axis=1, count=width)
+            dilated = cv2.dilate(strip, kernel, iterations=2)
+            del strip
+            strip_closed = cv2.erode(dilated, kernel, iterations=2)
+            del dilated
+            closed[top:bottom] = np.packbits(strip_closed[top - win_top:bottom - win_top], axis=1)
+            del strip_closed
+    return closed
+
+
+def _packed_contour_rects(packed, width, band, trace=None):
+    """
+    Contour pass over the packed closed map in overlapping windows. Window k owns the contours
+    whose top row lies in band k and holds bands k-1 to k+1: a cell up to one band tall is whole
+    inside its window, and so is any cell border around it, which RETR_EXTERNAL needs to drop
+    the artwork inside. Cells cut by an edge strip border are stitched back together here.
+    Returns (rects, None), or (None, height) once a contour reaches the bottom of its window -
+    it is taller than the band, at least height rows.
+    """
+    rects = []
+    height = packed.shape[0]
+    for top in range(0, height, band):
+        win_top = max(top - band, 0)
+        win_bottom = min(top + 2 * band, height)
+        with stage(trace, "contour_window", rows=f"{win_top}-{win_bottom}"):
+            closed = np.unpackbits(packed[win_top:win_bottom], axis=1, count=width)
+            contours, _ = cv2.findContours(closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            del closed
+
+        for cnt in contours:
+            x, y, w, h = cv2.boundingRect(cnt)
+            y += win_top
+            if not top <= y < top + band:
+                continue
+            if y + h >= win_bottom and win_bottom < height:
+                return None, h
+            rect = _cell_rect(cnt)
+            if rect is not None:
+                rects.append((x, y, w, h))
+    return rects, None
+
+
+def _contour_rects_tiled(template, memory_budget, debug_enabled=False, logger=None, trace=None):
+    """
+    The contour engine for sheets whose edge pipeline would not fit memory_budget bytes:
+    blur/Canny and the closing run in overlapping strips, Canny's hysteresis (which is not local)
+    runs over the whole bit-packed sheet, and contours are found on the bit-packed result.
+    Gives the same rects as _contour_rects. A contour taller than the contour windows allow
+    makes the bands grow to its height (only findContours runs again) - the budget is then exceeded.
+    """
+    width = template.width
+    # Two packed maps are alive at any time (weak + strong edges, then edges + closed map)
+    budget = max(memory_budget - 2 * template.height * ((width + 7) // 8), 0)
+    rows = max(budget // (width * EDGE_STRIP_BYTES_PER_PIXEL) - 2 * TILE_HALO, TILE_HALO)
+    link_band = max(budget // (width * LINK_BYTES_PER_PIXEL), 1)
+    band = max(budget // (width * CONTOUR_BYTES_PER_PIXEL) // 3, TILE_HALO)
+    if debug_enabled:
+        logger.info(f"Tiled detection: edge pipeline in strips of {rows} rows, hysteresis in bands of "
+                    f"{link_band} rows, contours in bands of {band} rows")
+
+    edges, strong = _packed_edge_candidates(template, rows, trace)
+    _link_packed_edges(edges, strong, width, link_band, trace)
+    del strong
+    packed = _packed_closed_map(edges, width, rows, trace)
+    del edges
+    while True:
+        rects, tall = _packed_contour_rects(packed, width, band, trace)
+        if rects is not None:
+            break
+        if debug_enabled:
+            logger.warning(f"A contour is taller than {band} rows - retrying with {tall}-row bands (over memory budget)")
+        band = tall
+    del packed
+
+    if debug_enabled:
+        logger.info(f"Filtered to {len(rects)} valid rectangles (area > 15000, aspect ratio 0.7-1.4)")
+    return sorted(rects, key=lambda r: (r[1] // 100, r[0]))
+
+
+def sort_reading_order(rects):
+    """
+    Sort rects top-to-bottom, left-to-right without absolute pixel constants.
+    A new row starts once a rect's top is more than half a median cell height below the row's first rect.
+    """
+    if not rects:
+        return []
+    row_gap = float(np.median([r[3] for r in rects])) / 2
+    rows = []
+    for rect in sorted(rects, key=lambda r: r[1]):
+        if rows and rect[1] - rows[-1][0][1] <= row_gap:
+            rows[-1].append(rect)
+        else:
+            rows.append([rect])
+    return [rect for row in rows for rect in sorted(row, key=lambda r: r[0])]
+
+
+def _strongest_edge(profile, fallback):
+    """Index of the strongest brightness step in a 1D profile (fallback if the profile is flat)"""
+    steps = np.abs(np.diff(profile))
+    if steps.size == 0 or steps.max() == 0:
+        return fallback
+    return int(np.argmax(steps)) + 1
+
+
+def _refine_rect(gray, rect, radius):
+    """
+    Snap a coarse (already upscaled) rect to the full resolution image.
+    Each edge only looks at a thin band of +-radius pixels around its coarse position,
+    using the middle half of the edge so corners and neighbours don't interfere.
+    """
+    img_h, img_w = gray.shape
+    x, y, w, h = rect
+    x1, y1 = x + w, y + h
+    # Middle half of each edge
+    my0, my1 = y + h // 4, max(y + 3 * h // 4, y + h // 4 + 1)
+    mx0, mx1 = x + w // 4, max(x + 3 * w // 4, x + w // 4 + 1)
+
+    def snap_x(cx):
+        lo, hi = max(cx - radius, 0), min(cx + radius, img_w)
+        band = gray[my0:my1, lo:hi].astype(np.int32)
+        return lo + _strongest_edge(band.sum(axis=0), cx - lo)
+
+    def snap_y(cy):
+        lo, hi = max(cy - radius, 0), min(cy + radius, img_h)
+        band = gray[lo:hi, mx0:mx1].astype(np.int32)
+        return lo + _strongest_edge(band.sum(axis=1), cy - lo)
+
+    left, right = snap_x(x), snap_x(x1)
+    top, bottom = snap_y(y), snap_y(y1)
+    if right <= left or bottom <= top:
+        return rect
+    return (left, top, right - left, bottom - top)
+
+
+def _pyramid_rects(template, debug_enabled=False, logger=None, debug_dir=None, trace=None):
+    """
+    Coarse-to-fine detection for large sheets.
+    Rects are found on a copy downscaled to PYRAMID_MAX_SIDE with thresholds relative
+    to the image size, then only the rect edges are refined at full resolution.
+    Gives the same grid for 1x, 2x or 4x exports of a template.
+    """
+    with stage(trace, "gray"):
+        gray = template.gray
+    full_h, full_w = gray.shape
+    scale = max(full_w, full_h) / PYRAMID_MAX_SIDE
+    if scale > 1:
+        with stage(trace, "downscale"):
+            small = cv2.resize(gray, (round(full_w / scale), round(full_h / scale)), interpolation=cv2.INTER_AREA)
+    else:
+        small, scale = gray, 1.0
+    small_h, small_w = small.shape
+
+    if debug_enabled:
+        logger.info(f"Pyramid detection on {small_w}x{small_h} (scale 1/{scale:.2f})")
+
+    # Same pipeline as the full resolution one, with the kernel scaled down to match
+    ksize = max(3, int(round(5 / scale)) | 1)
+    with stage(trace, "blur"):
+        blur = cv2.GaussianBlur(small, (ksize, ksize), 0)
+    with stage(trace, "canny"):
+        edges = cv2.Canny(blur, 40, 120)
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (ksize, ksize))
+    with stage(trace, "dilate_erode"):
+        closed = cv2.erode(cv2.dilate(edges, kernel, iterations=2), kernel, iterations=2)
+    with stage(trace, "contours"):
+        contours, _ = cv2.findContours(closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    if debug_enabled:
+        save_debug_image(debug_dir, "06_closed_final.png", closed, logger)
+        logger.info(f"Found {len(contours)} total contours")
+
+    min_area = MIN_CELL_AREA_FRACTION * small_w * small_h
+    radius = int(np.ceil(scale)) + 2
+    rects = []
+    with stage(trace, "refine"):
+        for cnt in contours:
+            if cv2.contourArea(cnt) < min_area:
+                continue
+            x, y, w, h = cv2.boundingRect(cnt)
+            # Filter by aspect ratio - emote cells are roughly square (0.7-1.4 allows slight rectangles)
+            if not 0.7 < w / float(h) < 1.4:
+                continue
+            coarse = (int(round(x * scale)), int(round(y * scale)), int(round(w * scale)), int(round(h * scale)))
+            rects.append(_refine_rect(gray, coarse, radius))
+
+    rects = sort_reading_order(rects)
+    if debug_enabled:
+        logger.info(f"Filtered to {len(rects)} valid rectangles (area > {MIN_CELL_AREA_FRACTION:.4f} of image, aspect ratio 0.7-1.4)")
+    return rects
+
+
+def _profile_lines(profile, min_fraction=0.5, merge_gap=3):
+    """
+    Grid line positions from a projection profile.
+    Returns (start, end) runs of indices above min_fraction of the peak, with runs
+    closer than merge_gap merged (a blurred border gives edges on 2-3 neighbouring lines).
+    """
+    if profile.size == 0 or profile.max() == 0:
+        return []
+    strong = np.flatnonzero(profile >= profile.max() * min_fraction)
+    # Split wherever two strong indices are further apart than merge_gap
+    breaks = np.flatnonzero(np.diff(strong) > merge_gap)
+    starts = np.concatenate(([strong[0]], strong[breaks + 1]))
+    ends = np.concatenate((strong[breaks], [strong[-1]]))
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+def _cell_intervals(lines):
+    """
+    Turn consecutive grid lines into cell spans.
+    Between lines alternate cells and gutters - gutters are the short ones.
+    """
+    spans = [(lines[i][0], lines[i + 1][1] + 1) for i in range(len(lines) - 1)]
+    if not spans:
+        return []
+    longest = max(end - start for start, end in spans)
+    return [(start, end) for start, end in spans if end - start >= longest / 2]
+
+
+def _border_support(edges, rect, band=2):
+    """Fraction of a rect's border that has an edge within +-band pixels"""
+    x, y, w, h = rect
+    img_h, img_w = edges.shape
+    sides = [
+        edges[max(y - band, 0):y + band + 1, x:x + w].any(axis=0),
+        edges[max(y + h - 1 - band, 0):min(y + h + band, img_h), x:x + w].any(axis=0),
+        edges[y:y + h, max(x - band, 0):x + band + 1].any(axis=1),
+        edges[y:y + h, max(x + w - 1 - band, 0):min(x + w + band, img_w)].any(axis=1),
+    ]
+    return min(float(side.mean()) if side.size else 0.0 for side in sides)
+
+
+def _grid_rects(template, debug_enabled=False, logger=None, debug_dir=None, trace=None):
+    """
+    Projection profile engine for regular grids.
+    Sums the edge map along rows and columns, takes the peaks as grid lines and
+    builds the rect lattice directly in reading order - no morphology, no contours.
+    """
+    with stage(trace, "gray"):
+        gray = template.gray
+    with stage(trace, "blur"):
+        blur = cv2.GaussianBlur(gray, (5, 5), 0)
+    with stage(trace, "canny"):
+        edges = cv2.Canny(blur, 40, 120)
+
+    if debug_enabled:
+        save_debug_image(debug_dir, "04_edges_canny.png", edges, logger)
+
+    # Column sums peak at vertical cell borders, row sums at horizontal ones
+    with stage(trace, "profiles"):
+        mask = edges > 0
+        col_lines = _profile_lines(np.count_nonzero(mask, axis=0))
+        row_lines = _profile_lines(np.count_nonzero(mask, axis=1))
+    columns = _cell_intervals(col_lines)
+    rows = _cell_intervals(row_lines)
+
+    if debug_enabled:
+        logger.info(f"Grid lines: {len(col_lines)} vertical, {len(row_lines)} horizontal "
+                    f"-> {len(columns)} columns x {len(rows)} rows")
+
+    min_area = MIN_CELL_AREA_FRACTION * template.width * template.height
+    rects = []
+    for y0, y1 in rows:
+        for x0, x1 in columns:
+            rect = (x0, y0, x1 - x0, y1 - y0)
+            w, h = rect[2], rect[3]
+            if w * h < min_area or not 0.7 < w / float(h) < 1.4:
+                continue
+            # Irregular sheets: only keep lattice positions that really have a border drawn
+            if _border_support(mask, rect) < 0.5:
+                continue
+            rects.append(rect)
+
+    if debug_enabled:
+        logger.info(f"Filtered to {len(rects)} valid rectangles from the grid lattice")
+    return rects
+
+
+# Rect finding engines selectable with detect_emotes_with_rects(engine=...)
+DETECTION_ENGINES = {
+    "contours": _contour_rects,
+    "pyramid": _pyramid_rects,
+    "grid": _grid_rects,
+}
+
+
+def find_emote_rects(template, debug_enabled=False, logger=None, debug_dir=None, engine="contours", trace=None,
+                     memory_budget=None):
+    """
+    Find the grid cell rects in reading order with the chosen engine.
+    With memory_budget (bytes), the contour engine runs in strips when the whole sheet would not fit.
+    """
+    if engine not in DETECTION_ENGINES:
+        raise ValueError(f"Unknown detection engine '{engine}', expected one of {sorted(DETECTION_ENGINES)}")
+    if (engine == "contours" and memory_budget is not None
+            and template.width * template.height * EDGE_PIPELINE_BYTES_PER_PIXEL > memory_budget):
+        return _contour_rects_tiled(template, memory_budget, debug_enabled, logger, trace)
+    return DETECTION_ENGINES[engine](template, debug_enabled, logger, debug_dir, trace)
+
+
+def _reduce_in_strips(template, factor, memory_budget):
+    """template.image.reduce(factor) without its full-size premultiplied copy: factor-aligned row strips"""
+    rows = max(memory_budget // (template.width * PREVIEW_BYTES_PER_PIXEL) // factor, 1) * factor
+    reduced = Image.new("RGBA", (-(-template.width // factor), -(-template.height // factor)))
+    for top in range(0, template.height, rows):
+        strip = Image.fromarray(template.rgba[top:top + rows])
+        reduced.paste(strip.reduce(factor), (0, top // factor))
+    return reduced
+
+
+def render_preview(source, cell_infos, max_size=None, max_scale=1.0, memory_budget=None):
+    """
+    Marked preview image: green border + number for filled cells, red border for empty ones.
+    The sheet is shrunk first (reduce-style fast downscale) to fit max_size (w, h) and
+    max_scale, then the overlays are drawn at that scale - no full resolution copy needed.
+    With memory_budget (bytes) the shrinking works in row strips.
+    """
+    template = _as_template(source)
+    scale = max_scale
+    if max_size is not None:
+        scale = min(scale, max_size[0] / template.width, max_size[1] / template.height)
+
+    if scale >= 1:
+        # Copy: the preview gets drawn on, the shared buffer must stay clean
+        img = template.image.copy()
+        scale = 1.0
+    else:
+        size = (max(1, int(template.width * scale)), max(1, int(template.height * scale)))
+        # Fast integer box reduce does most of the shrinking, a cheap bilinear pass the rest
+        factor = max(1, int(1 / scale))
+        if factor > 1 and memory_budget is not None:
+            img = _reduce_in_strips(template, factor, memory_budget)
+        else:
+            img = template.image.reduce(factor) if factor > 1 else template.image
+        img = img.resize(size, Image.Resampling.BILINEAR)
+
+    draw = ImageDraw.Draw(img)
+    filled_width = max(1, round(4 * scale))
+    empty_width = max(1, round(2 * scale))
+    font_size = max(8, round(24 * scale))
+    for cell in cell_infos:
+        x, y, w, h = (int(v * scale) for v in cell["rect"])
+        if cell["has_content"]:
             # Green border + number for filled cells
-            draw.rectangle([x, y, x+w-1, y+h-1], outline="lime", width=4)
-            draw.text((x+10, y+10), str(filled_count), fill="white", font_size=24)
-            cell_infos.append({"rect": (x, y, w, h), "has_content": True, "id": filled_count})
-            
-            if debug_enabled:
-                logger.debug(f"Cell #{filled_count}: FILLED at position ({x}, {y}), size {w}x{h}")
-            
-            filled_count += 1
+            draw.rectangle([x, y, x+w-1, y+h-1], outline="lime", width=filled_width)
+            draw.text((x + round(10 * scale), y + round(10 * scale)), str(cell["id"]), fill="white", font_size=font_size)
         else:
             # Red border for empty cells
-            draw.rectangle([x, y, x+w-1, y+h-1], outline="red", width=2)
-            cell_infos.append({"rect": (x, y, w, h), "has_content": False})
-            
-            if debug_enabled:
-                logger.debug(f"Cell: EMPTY at position ({x}, {y}), size {w}x{h}")
+            draw.rectangle([x, y, x+w-1, y+h-1], outline="red", width=empty_width)
+    return img
+
+
+def cell_thumbnail(source, rect, size=40, padding=5):
+    """Small square thumbnail of one cell (same crop as the export uses)"""
+    template = _as_template(source)
+    x, y, w, h = rect
+    crop = template.image.crop((x + padding, y + padding, x + w - padding, y + h - padding))
+    return crop.resize((size, size), Image.Resampling.LANCZOS, reducing_gap=2.0)
+
+
+def detect_emotes_with_rects(source, debug_enabled=False, brightness_threshold=15, min_fraction=0.03, use_cache=True,
+                             use_registry=True, engine="contours", preview_size=None, preview_max_scale=1.0,
+                             trace=None, memory_budget=None):
+    """
+    Detect rectangles, number filled ones, return marked image + cell data.
+    source can be a filename or a LoadedTemplate.
+    Each cell info carries its "fill" fraction so min_fraction can be re-tuned with classify_cells.
+    Results are kept in the persistent detection cache unless use_cache is False or debug is on.
+    Sheets drawn on a known template layout use its stored grid unless use_registry is False.
+    Other sheets go through the rect finding engine (see DETECTION_ENGINES).
+    The marked image is full size unless preview_size/preview_max_scale ask for a smaller one.
+    Pass an instrumentation.Trace as trace to get timing (and memory) per stage.
+    memory_budget (bytes) caps the detection working memory on top of the decoded sheet:
+    bigger sheets are scanned in overlapping strips, with the same cell_infos.
+    """
+    template = _as_template(source, trace)
+    filename = template.path
     
+    # Optional debug logging for bug reports
+    logger = None
+    debug_dir = None
     if debug_enabled:
+        logger, debug_dir = setup_logging(filename)
+        logger.info("=== EMOTE DETECTION STARTED ===")
+        logger.info(f"Input file: {filename}")
+    
+    # === STEP 1 + 2: Find Rectangles ===
+    # Unchanged sheets with the same parameters come straight from the persistent cache
+    cell_infos = None
+    registry = get_template_registry() if use_registry else None
+    cache = get_detection_cache() if use_cache and not debug_enabled else None
+    if cache is not None:
+        cache_key = make_key(
+            template.content_hash,
+            {
+                "brightness_threshold": brightness_threshold,
+                "min_fraction": min_fraction,
+                "engine": engine,
+                "registry": registry.signature if registry is not None else None,
+            },
+            DETECTION_VERSION,
+        )
+        with stage(trace, "cache_lookup"):
+            cell_infos = cache.get(cache_key)
+
+    if cell_infos is None:
+        # Known layouts (the shipped templates or user registered ones) skip the contour pipeline
+        known = None
+        if registry is not None:
+            with stage(trace, "registry_match"):
+                known, distance = registry.match(template)
+
+        if known is not None:
+            rects = known.rects_for(template.width, template.height)
+            if debug_enabled:
+                logger.info(f"Matched known template '{known.name}' (distance {distance:.2f}) - using stored grid")
+        else:
+            rects = find_emote_rects(template, debug_enabled, logger, debug_dir, engine, trace, memory_budget)
+
+        # === STEP 3: Analyze Cell Content ===
+        # One thresholding pass + summed-area table answers every cell at once
+        with stage(trace, "content_check", cells=len(rects)):
+            fills = cell_fill_fractions(template, rects, brightness_threshold, memory_budget)
+            cell_infos = classify_cells(rects, fills, min_fraction)
+
+        if cache is not None:
+            cache.put(cache_key, cell_infos)
+
+    rects = [cell["rect"] for cell in cell_infos]
+    filled_count = sum(1 for c in cell_infos if c["has_content"]) + 1
+
+    # === STEP 4: Mark Cells and Number Filled Ones ===
+    with stage(trace, "preview"):
+        pil_img = render_preview(template, cell_infos, preview_size, preview_max_scale, memory_budget)
+
+    if debug_enabled:
+        for cell in cell_infos:
+            x, y, w, h = cell["rect"]
+            if cell["has_content"]:
+                logger.debug(f"Cell #{cell['id']}: FILLED at position ({x}, {y}), size {w}x{h}, fill {cell['fill']:.3f}")
+            else:
+                logger.debug(f"Cell: EMPTY at position ({x}, {y}), size {w}x{h}, fill {cell['fill']:.3f}")
+        
         logger.info(f"Detection complete: {filled_count - 1} filled, {len(rects) - (filled_count - 1)} empty")
         
         # Save debug preview image
-        debug_img_path = os.path.join(debug_dir, "debug.png")
-        pil_img.save(debug_img_path)
-        logger.info(f"Debug preview saved: {debug_img_path}")
+        debug_img_path = save_debug_image(debug_dir, "debug.png", pil_img, logger)
+        if debug_img_path:
+            logger.info(f"Debug preview queued: {debug_img_path}")
         logger.info("=== DETECTION PHASE COMPLETE ===")
     
     return pil_img, cell_infos
 
 
-def export_emotes(current_filename, name_entries, selected_platforms, debug_enabled=False):
-    """Export emotes in platform-specific sizes"""
+def safe_emote_name(name, cell_id):
+    """Use provided name or fallback to numbered default, stripped of file system unsafe characters"""
+    base_name = name.strip() or f"emote_{cell_id}"
+    # Sanitize filename - remove special characters that cause file system issues
+    safe_name = "".join(c for c in base_name if c.isalnum() or c in (" ", "-", "_")).rstrip()
+    return safe_name or f"emote_{cell_id}"
+
+
+def plan_export(name_entries, selected_platforms):
+    """
+    Build the list of resize jobs for an export.
+    Every unique (cell, size) becomes one job, listing all files it feeds -
+    kick and discord share 128/64/32, so those are resized and encoded only once.
+    """
+    jobs = []
+    for cell, name in name_entries:
+        safe_name = safe_emote_name(name, cell["id"])
+        cell_jobs = {}
+        for platform in selected_platforms:
+            for size in platform_sizes[platform]:
+                job = cell_jobs.get(size)
+                if job is None:
+                    job = {"cell": cell, "name": safe_name, "size": size, "files": []}
+                    cell_jobs[size] = job
+                    jobs.append(job)
+                job["files"].append((platform, f"{safe_name}_{platform}_{size[0]}x{size[1]}.png"))
+    return jobs
+
+
+def resize_chain_pil(crop, sizes):
+    """
+    Reference resampler: every size straight from the crop with PIL LANCZOS
+    (Pillow premultiplies RGBA internally). crop is an RGBA uint8 array.
+    Returns {size: PIL image}.
+    """
+    img = Image.fromarray(np.ascontiguousarray(crop), "RGBA")
+    # LANCZOS gives best quality for downscaling
+    return {size: img.resize(size, Image.Resampling.LANCZOS) for size in sizes}
+
+
+def resize_chain_opencv(crop, sizes):
+    """
+    Batched resampler: premultiply alpha once, then build all sizes as one chain of
+    cv2.resize INTER_AREA calls, largest first. Each size starts from the smallest
+    level already made that is at least twice as big (128 -> 64 -> 32), so every
+    step is a clean box filter. crop is an RGBA uint8 array. Returns {size: PIL image}.
+    """
+    premultiplied = crop.astype(np.float32)
+    premultiplied[:, :, :3] *= premultiplied[:, :, 3:] * (1 / 255)
+
+    levels = []
+    results = {}
+    for size in sorted(set(sizes), key=lambda s: s[0] * s[1], reverse=True):
+        sources = [level for level in levels if level.shape[1] >= 2 * size[0] and level.shape[0] >= 2 * size[1]]
+        source = min(sources, key=lambda level: level.shape[0] * level.shape[1]) if sources else premultiplied
+        level = cv2.resize(source, size, interpolation=cv2.INTER_AREA)
+        levels.append(level)
+
+        # Back to straight alpha for PNG
+        alpha = level[:, :, 3:]
+        rgb = np.divide(level[:, :, :3] * 255, alpha, out=np.zeros_like(level[:, :, :3]), where=alpha > 0)
+        out = np.empty(level.shape, dtype=np.uint8)
+        np.clip(rgb + 0.5, 0, 255, out=out[:, :, :3], casting="unsafe")
+        np.clip(alpha + 0.5, 0, 255, out=out[:, :, 3:], casting="unsafe")
+        results[size] = Image.fromarray(out, "RGBA")
+    return results
+
+
+# Resize backends selectable with export_emotes(resampler=...)
+RESAMPLERS = {
+    "pil": resize_chain_pil,
+    "opencv": resize_chain_opencv,
+}
+
+
+def _save_png(img, compress_level, optimize):
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG", compress_level=compress_level, optimize=optimize)
+    return buffer.getvalue()
+
+
+def _palette_version(img, colors):
+    """Quantize to a palette image and return it with its max per-channel error"""
+    quantized = img.quantize(colors=colors, method=Image.Quantize.FASTOCTREE)
+    error = np.abs(np.asarray(quantized.convert("RGBA"), dtype=np.int16) - np.asarray(img, dtype=np.int16)).max()
+    return quantized, int(error)
+
+
+def encode_png(img, profile="balanced", byte_budget=None):
+    """
+    Encode an RGBA emote as PNG with an encoding profile.
+    If the result is over byte_budget, a bounded search tries max compression and
+    then palettes of shrinking size, skipping palettes off by more than BUDGET_MAX_ERROR,
+    and returns the first encoding that fits (or the smallest acceptable one, reported
+    as over_budget). Returns (data, info) where info tells what was picked.
+    """
+    settings = ENCODING_PROFILES[profile]
+    data = _save_png(img, settings["compress_level"], settings["optimize"])
+    info = {"profile": profile, "palette": None, "max_error": 0, "over_budget": False}
+
+    # Palette PNGs are much smaller - use one when it stays within the profile's tolerance
+    tolerance = settings["quantize_tolerance"]
+    if tolerance is not None:
+        # Few enough colors for an exact palette? getcolors gives up past 256
+        unique = img.getcolors(256)
+        colors = len(unique) if unique else 256
+        quantized, error = _palette_version(img, colors)
+        if error <= tolerance:
+            palette_data = _save_png(quantized, settings["compress_level"], settings["optimize"])
+            if len(palette_data) < len(data):
+                data = palette_data
+                info.update(palette=colors, max_error=error)
+
+    if byte_budget is None or len(data) <= byte_budget:
+        return data, info
+
+    # === Over budget: bounded search for the smallest acceptable encoding ===
+    candidates = [(data, dict(info))]
+    candidates.append((_save_png(img, 9, True), dict(info, palette=None, max_error=0)))
+    if len(candidates[-1][0]) > byte_budget:
+        for colors in BUDGET_PALETTE_STEPS:
+            quantized, error = _palette_version(img, colors)
+            if error > BUDGET_MAX_ERROR:
+                continue
+            candidates.append((_save_png(quantized, 9, True), dict(info, palette=colors, max_error=error)))
+            if len(candidates[-1][0]) <= byte_budget:
+                break
+
+    data, info = min(candidates, key=lambda c: len(c[0]))
+    info["over_budget"] = len(data) > byte_budget
+    return data, info
+
+
+def _job_budget(job, byte_budgets):
+    """Strictest byte budget among the platforms a job writes for, or None"""
+    budgets = [byte_budgets[p] for p, _ in job["files"] if byte_budgets and byte_budgets.get(p)]
+    return min(budgets) if budgets else None
+
+
+def _manifest_path(out_dir, source_path):
+    """Each template gets its own manifest, so templates sharing a folder never touch each other's files"""
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    return os.path.join(out_dir, stem + MANIFEST_SUFFIX)
+
+
+def _read_manifest(out_dir, source_path):
+    """Entries of source_path's previous export in out_dir, keyed by file name ({} if missing or outdated)"""
+    try:
+        with open(_manifest_path(out_dir, source_path), encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(data, dict) or data.get("version") != EXPORT_VERSION:
+        return {}
+    if data.get("template") != os.path.abspath(source_path):
+        # Same stem, different template (a.png vs a.webp, or another folder) - not ours to prune
+        return {}
+    return data.get("files", {})
+
+
+def _write_manifest(out_dir, source_path, entries):
+    path = _manifest_path(out_dir, source_path)
+    # Write to a private temp file and replace in one step: an interrupted export never leaves
+    # a half-written manifest, and concurrent exports never write into the same temp file
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path), suffix=".tmp", dir=out_dir)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(
+                {"version": EXPORT_VERSION, "template": os.path.abspath(source_path), "files": entries},
+                f, indent=1, sort_keys=True,
+            )
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _is_up_to_date(out_dir, filename, old, expected):
+    """A previous output can be kept if its inputs match and the file is still there, untouched"""
+    if old is None or any(old.get(key) != value for key, value in expected.items()):
+        return False
+    try:
+        return os.path.getsize(os.path.join(out_dir, filename)) == old.get("bytes")
+    except OSError:
+        return False
+
+
+def _run_export_cell(crop, jobs, out_dir, cancel_event=None, trace=None, encoding="balanced", byte_budgets=None,
+                     resampler="pil"):
+    """
+    Resize one cell's crop to all of its sizes in one resampler call, then encode and write each size.
+    Returns the finished jobs - fewer (or none) if the export was cancelled in between.
+    """
+    if cancel_event is not None and cancel_event.is_set():
+        return []
+    with stage(trace, "resize", cell=jobs[0]["cell"]["id"], sizes=len(jobs), resampler=resampler):
+        sized = RESAMPLERS[resampler](crop, [job["size"] for job in jobs])
+
+    done = []
+    for job in jobs:
+        if cancel_event is not None and cancel_event.is_set():
+            break
+        done.append(_run_export_job(sized[job["size"]], job, out_dir, trace, encoding, byte_budgets))
+    return done
+
+
+def _run_export_job(sized_emote, job, out_dir, trace=None, encoding="balanced", byte_budgets=None):
+    """
+    Encode one resized emote once and write it for every platform that wants it.
+    The strictest byte budget of those platforms applies.
+    With out_dir None nothing is written - the PNG bytes are left in job["data"] for an archive.
+    """
+    size_label = f"{job['size'][0]}x{job['size'][1]}"
+    encode_start = time.perf_counter()
+    with stage(trace, "encode", size=size_label, cell=job["cell"]["id"]):
+        data, info = encode_png(sized_emote, encoding, _job_budget(job, byte_budgets))
+    job["encode_ms"] = (time.perf_counter() - encode_start) * 1000
+    job["bytes"] = len(data)
+    job["encoding"] = info
+
+    if out_dir is None:
+        job["data"] = data
+        return job
+
+    with stage(trace, "write", files=len(job["files"]), bytes=len(data)):
+        for _, filename in job["files"]:
+            with open(os.path.join(out_dir, filename), "wb") as f:
+                f.write(data)
+    return job
+
+
+def export_emotes(source, name_entries, selected_platforms, debug_enabled=False, max_workers=None,
+                  progress_callback=None, cancel_event=None, trace=None, encoding="balanced",
+                  byte_budgets=platform_byte_budgets, report=None, target="folder", in_memory=False,
+                  incremental=True, output_dir=None, resampler="pil"):
+    """
+    Export emotes in platform-specific sizes.
+    source can be a filename or a LoadedTemplate (reuses the decode from detection).
+    progress_callback(files_done, files_total) is called after every written file group.
+    Setting cancel_event (a threading.Event) stops the export after the files in flight;
+    the returned count then only includes what was actually written.
+    Pass an instrumentation.Trace as trace to get timing (and memory) per resize/encode
+    (a memory trace runs the export on one thread, see Trace.pool_size).
+    encoding picks a profile from ENCODING_PROFILES; byte_budgets maps platform -> max bytes.
+    If report is a list, one entry per written file is appended (name, bytes, encode time, ...).
+
+    target picks where the PNGs go:
+        "folder"         loose files in emotes_export_multi/ (returns its path)
+        "zip"            one emotes_export_multi.zip next to the source (returns its path)
+        "platform_zips"  one emotes_export_<platform>.zip per platform (returns {platform: path})
+    With in_memory=True the ZIPs are built in memory and returned as bytes ({platform: bytes}).
+    A cancelled (or failed) ZIP export deletes its partial archives and returns (0, None / {});
+    its report entries then say "discarded" instead of "written".
+
+    Folder exports keep a manifest per template (hash of the cropped pixels, name, size and
+    encode settings per file). With incremental=True only files whose inputs changed are
+    re-encoded, and outputs of this template for selected platforms that are no longer
+    planned (renamed emotes) are deleted - other templates' files in the folder are left alone.
+    Report entries carry a status: "written", "skipped" or "deleted".
+    The returned count includes skipped files; ZIP targets are always rebuilt completely.
+
+    output_dir overrides where things go: the export folder itself for "folder",
+    the folder the ZIP(s) are written to otherwise. Default is next to the source.
+    resampler picks a backend from RESAMPLERS: "pil" (LANCZOS, the reference) or
+    "opencv" (batched INTER_AREA chain on premultiplied alpha, faster).
+    """
+    if resampler not in RESAMPLERS:
+        raise ValueError(f"Unknown resampler '{resampler}', expected one of {sorted(RESAMPLERS)}")
+    if target not in EXPORT_TARGETS:
+        raise ValueError(f"Unknown export target '{target}', expected one of {EXPORT_TARGETS}")
+    if in_memory and target == "folder":
+        raise ValueError("in_memory needs a ZIP target")
+
+    template = _as_template(source, trace)
+    current_filename = template.path
     
     # Set up logging if debug is enabled
     logger = None
@@ -207,53 +1268,212 @@ def export_emotes(current_filename, name_entries, selected_platforms, debug_enab
         logger.info(f"Platforms selected: {selected_platforms}")
         logger.info(f"Emotes to export: {len(name_entries)}")
     
-    # Platform size requirements
-    platform_sizes = {
-        "twitch": [(112, 112), (56, 56), (28, 28)],
-        "twitchbages": [(72, 72), (36, 36), (18, 18)],
-        "discord": [(128, 128),(64, 64), (32, 32)],
-        "youtube": [ (48, 48), (24, 24)],
-        "kick": [(128, 128), (64, 64), (32, 32)]
-    }
-
-    base_img = Image.open(current_filename).convert("RGBA")
-    # Create output folder next to source image
-    out_dir = os.path.join(os.path.dirname(current_filename), "emotes_export_multi")
-    os.makedirs(out_dir, exist_ok=True)
+    base_dir = output_dir or os.path.dirname(current_filename)
+    # Archive key -> (destination, open ZipFile); key is the platform, or None for the shared ZIP
+    archives = {}
+    if target == "folder":
+        # Create output folder next to source image
+        out_dir = output_dir or os.path.join(base_dir, "emotes_export_multi")
+        os.makedirs(out_dir, exist_ok=True)
+    else:
+        # PNGs are deflated already - store them, and stream each one in as soon as it's encoded
+        out_dir = None
+        os.makedirs(base_dir, exist_ok=True)
+        for key in (selected_platforms if target == "platform_zips" else [None]):
+            dest = io.BytesIO() if in_memory else os.path.join(
+                base_dir, f"emotes_export_{key}.zip" if key else "emotes_export_multi.zip"
+            )
+            archives[key] = (dest, zipfile.ZipFile(dest, "w", zipfile.ZIP_STORED))
     
     if debug_enabled:
-        logger.info(f"Output directory: {out_dir}")
+        if out_dir is not None:
+            logger.info(f"Output directory: {out_dir}")
+        else:
+            logger.info(f"Output: {target}{' in memory' if in_memory else ''}")
+
+    # === STEP 1: Plan ===
+    # Work out every unique (cell, size) up front so nothing is resized twice
+    jobs = plan_export(name_entries, selected_platforms)
+
+    if debug_enabled:
+        file_count = sum(len(job["files"]) for job in jobs)
+        logger.info(f"Export plan: {len(jobs)} resizes for {file_count} files")
+
+    # Crop each cell once - all of its sizes start from the same crop (views into the RGBA buffer, no copies)
+    padding = 5
+    crops = {}
+    with stage(trace, "crop", cells=len(name_entries)):
+        for cell, _ in name_entries:
+            x, y, w, h = cell["rect"]
+            crops[cell["id"]] = template.rgba[y + padding:y + h - padding, x + padding:x + w - padding]
+
+    # === Incremental: keep outputs whose inputs didn't change ===
+    previous = _read_manifest(out_dir, current_filename) if out_dir is not None else {}
+    manifest = {}
+    skipped_count = 0
+    if out_dir is not None:
+        with stage(trace, "manifest", files=len(previous)):
+            source_hashes = {
+                cell_id: hashlib.blake2b(np.ascontiguousarray(crop), digest_size=16).hexdigest()
+                for cell_id, crop in crops.items()
+            }
+            pending_jobs = []
+            for job in jobs:
+                job["entry"] = {
+                    "name": job["name"],
+                    "size": list(job["size"]),
+                    "source": source_hashes[job["cell"]["id"]],
+                    "settings": {
+                        "encoding": encoding, "budget": _job_budget(job, byte_budgets), "padding": padding,
+                        "resampler": resampler,
+                    },
+                }
+                stale = []
+                for platform, filename in job["files"]:
+                    old = previous.get(filename)
+                    if incremental and _is_up_to_date(out_dir, filename, old, dict(job["entry"], platform=platform)):
+                        manifest[filename] = old
+                        skipped_count += 1
+                        if report is not None:
+                            report.append({
+                                "file": filename,
+                                "platform": platform,
+                                "size": f"{job['size'][0]}x{job['size'][1]}",
+                                "bytes": old["bytes"],
+                                "encode_ms": 0.0,
+                                "profile": encoding,
+                                "palette": old.get("palette"),
+                                "max_error": old.get("max_error", 0),
+                                "over_budget": old.get("over_budget", False),
+                                "status": "skipped",
+                            })
+                    else:
+                        stale.append((platform, filename))
+                if stale:
+                    job["files"] = stale
+                    pending_jobs.append(job)
+            jobs = pending_jobs
 
+        if debug_enabled:
+            logger.info(f"Incremental export: {skipped_count} files unchanged, {len(jobs)} resizes left")
+
+    # === STEP 2: Resize + Encode ===
+    report_start = len(report) if report is not None else 0
+    # Pillow and OpenCV release the GIL while resizing and compressing, so threads scale here
     exported_count = 0
-    for cell, name in name_entries:
-        # Use provided name or fallback to numbered default
-        base_name = name.strip() or f"emote_{cell['id']}"
-        x, y, w, h = cell["rect"]
-        padding = 5
-        crop = base_img.crop((x + padding, y + padding, x + w - padding, y + h - padding))
-        
+    total_files = sum(len(job["files"]) for job in jobs)
+    if progress_callback is not None:
+        progress_callback(0, total_files)
+
+    finished_cleanly = False
+    try:
+        with ThreadPoolExecutor(max_workers=trace.pool_size(max_workers) if trace else max_workers) as pool:
+            # One task per cell: its whole size chain comes from one resampler call
+            cell_jobs = {}
+            for job in jobs:
+                cell_jobs.setdefault(job["cell"]["id"], []).append(job)
+            futures = [
+                pool.submit(
+                    _run_export_cell, crops[cell_id], group, out_dir, cancel_event, trace, encoding, byte_budgets,
+                    resampler,
+                )
+                for cell_id, group in cell_jobs.items()
+            ]
+            for future in as_completed(futures):
+                finished = [] if future.cancelled() else future.result()
+                for job in finished:
+                    if archives:
+                        # ZipFile isn't thread-safe, so archive writes happen here on the calling thread
+                        data = job.pop("data")
+                        with stage(trace, "write", files=len(job["files"]), bytes=len(data)):
+                            for platform, filename in job["files"]:
+                                archives[platform if target == "platform_zips" else None][1].writestr(filename, data)
+                    exported_count += len(job["files"])
+
+                    if progress_callback is not None:
+                        progress_callback(exported_count, total_files)
+
+                    for platform, filename in job["files"]:
+                        if out_dir is not None:
+                            manifest[filename] = dict(
+                                job["entry"], platform=platform, bytes=job["bytes"],
+                                palette=job["encoding"]["palette"], max_error=job["encoding"]["max_error"],
+                                over_budget=job["encoding"]["over_budget"],
+                            )
+                        if report is not None:
+                            report.append({
+                                "file": filename,
+                                "platform": platform,
+                                "size": f"{job['size'][0]}x{job['size'][1]}",
+                                "bytes": job["bytes"],
+                                "encode_ms": job["encode_ms"],
+                                **job["encoding"],
+                                "status": "written",
+                            })
+                        if debug_enabled:
+                            logger.debug(
+                                f"  Saved: {filename} for {platform} ({job['bytes']} bytes, encode {job['encode_ms']:.1f} ms)"
+                            )
+                            if job["encoding"]["over_budget"]:
+                                logger.warning(f"  {filename} is over the {platform} size limit even after recompression")
+
+                if cancel_event is not None and cancel_event.is_set():
+                    # Drop everything that hasn't started yet
+                    for pending in futures:
+                        pending.cancel()
+        finished_cleanly = True
+    finally:
+        for _, archive in archives.values():
+            archive.close()
+        cancelled = cancel_event is not None and cancel_event.is_set()
+        if archives and (not finished_cleanly or (cancelled and exported_count < total_files)):
+            # A ZIP missing some emotes looks complete from the outside - don't leave one behind
+            for dest, _ in archives.values():
+                if not in_memory:
+                    try:
+                        os.remove(dest)
+                    except FileNotFoundError:
+                        pass
+            archives.clear()
+            # Nothing written survives - report it that way
+            exported_count = 0
+            if report is not None:
+                for entry in report[report_start:]:
+                    if entry["status"] == "written":
+                        entry["status"] = "discarded"
+            if debug_enabled:
+                logger.info("Partial ZIP output removed")
+
+    # === STEP 3: Manifest ===
+    if out_dir is not None:
+        deleted_count = 0
+        for filename, old in previous.items():
+            if filename in manifest:
+                continue
+            if cancelled or old.get("platform") not in selected_platforms:
+                # Not part of this export (or not reached yet) - keep the record so it stays tracked
+                manifest[filename] = old
+                continue
+            # Planned before but not any more: the emote was renamed or removed
+            try:
+                os.remove(os.path.join(out_dir, filename))
+            except FileNotFoundError:
+                pass
+            deleted_count += 1
+            if report is not None:
+                report.append({"file": filename, "platform": old.get("platform"), "status": "deleted"})
+        _write_manifest(out_dir, current_filename, manifest)
         if debug_enabled:
-            logger.info(f"Processing emote #{cell['id']}: '{base_name}'")
+            logger.info(f"Manifest: {exported_count} files written, {skipped_count} unchanged, {deleted_count} deleted")
+    exported_count += skipped_count
 
-        # Generate all required sizes for each selected platform
-        for platform in selected_platforms:
-            for size_w, size_h in platform_sizes[platform]:
-                # LANCZOS gives best quality for downscaling
-                sized_emote = crop.resize((size_w, size_h), Image.Resampling.LANCZOS)
-                # Sanitize filename - remove special characters that cause file system issues
-                safe_name = "".join(c for c in base_name if c.isalnum() or c in (" ", "-", "_")).rstrip()
-                if not safe_name:
-                    safe_name = f"emote_{cell['id']}"
-                
-                filename = f"{safe_name}_{platform}_{size_w}x{size_h}.png"
-                out_path = os.path.join(out_dir, filename)
-                sized_emote.save(out_path, format="PNG")
-                exported_count += 1
-                
-                if debug_enabled:
-                    logger.debug(f"  Saved: {filename} for {platform}")
-    
     if debug_enabled:
-        logger.info(f"=== EXPORT COMPLETE: {exported_count} files created ===")
+        if cancelled:
+            logger.info(f"=== EXPORT CANCELLED: {exported_count} of {total_files} files created ===")
+        else:
+            logger.info(f"=== EXPORT COMPLETE: {exported_count} files created ===")
     
-    return exported_count, out_dir
+    if target == "folder":
+        return exported_count, out_dir
+    outputs = {key: dest.getvalue() if in_memory else dest for key, (dest, _) in archives.items()}
+    return exported_count, outputs.get(None) if target == "zip" else outputs
@@ -0,0 +1,136 @@
+"""
+Background writer for debug artifacts.
+
+Debug images are handed to a queue and encoded/saved on a worker thread, so
+debug mode no longer multiplies detection time. Overlay images (contours,
+accepted rectangles) are passed as callables and only drawn on the worker.
+
+Settings (change with configure_debug_artifacts):
+    image_format  "png" or "jpg"
+    compression   PNG zlib level 0-9 (1 = fast, default)
+    jpeg_quality  JPEG quality 1-95
+    max_side      downscale artifacts so the long side fits (None = full size)
+    stages        set of stage names to dump, None = all. Names are the file
+                  names without number and extension: "original", "grayscale",
+                  "blurred", "edges_canny", "dilated", "closed_final",
+                  "all_contours", "accepted_rectangles", "debug"
+"""
+import atexit
+import os
+import queue
+import threading
+
+import numpy as np
+from PIL import Image
+
+
+debug_settings = {
+    "image_format": "png",
+    "compression": 1,
+    "jpeg_quality": 85,
+    "max_side": None,
+    "stages": None,
+}
+
+# Bounded so a slow disk applies backpressure instead of piling up full-size images
+_QUEUE_SIZE = 8
+_queue = queue.Queue(maxsize=_QUEUE_SIZE)
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def configure_debug_artifacts(**settings):
+    """Update debug artifact settings, e.g. configure_debug_artifacts(image_format="jpg", max_side=1024)"""
+    unknown = set(settings) - set(debug_settings)
+    if unknown:
+        raise ValueError(f"Unknown debug setting(s): {sorted(unknown)}")
+    if "stages" in settings and settings["stages"] is not None:
+        settings["stages"] = set(settings["stages"])
+    debug_settings.update(settings)
+
+
+def stage_name(filename):
+    """'07_all_contours.png' -> 'all_contours'"""
+    stem = os.path.splitext(filename)[0]
+    prefix, _, rest = stem.partition("_")
+    return rest if prefix.isdigit() and rest else stem
+
+
+def wants_stage(filename):
+    """True if this artifact should be written with the current settings"""
+    stages = debug_settings["stages"]
+    return stages is None or stage_name(filename) in stages
+
+
+def _to_pil(image):
+    """OpenCV arrays are BGR (or single channel), PIL wants RGB"""
+    if isinstance(image, Image.Image):
+        return image
+    if image.ndim == 2:
+        return Image.fromarray(image)
+    return Image.fromarray(np.ascontiguousarray(image[:, :, 2::-1]))
+
+
+def _write(path, image, settings):
+    if callable(image):
+        image = image()
+    img = _to_pil(image)
+
+    max_side = settings["max_side"]
+    if max_side and max(img.size) > max_side:
+        factor = max_side / max(img.size)
+        img = img.resize((max(1, int(img.width * factor)), max(1, int(img.height * factor))), Image.Resampling.BILINEAR)
+
+    if settings["image_format"] == "jpg":
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.save(path, format="JPEG", quality=settings["jpeg_quality"])
+    else:
+        img.save(path, format="PNG", compress_level=settings["compression"])
+
+
+def _run():
+    while True:
+        path, image, settings, logger = _queue.get()
+        try:
+            _write(path, image, settings)
+            if logger is not None:
+                logger.debug(f"Saved debug image: {os.path.basename(path)}")
+        except Exception as e:
+            if logger is not None:
+                logger.error(f"Failed to save debug image {os.path.basename(path)}: {e}")
+        finally:
+            _queue.task_done()
+
+
+def _ensure_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run, name="debug-writer", daemon=True)
+            _worker.start()
+
+
+def queue_debug_image(debug_dir, filename, image, logger=None):
+    """
+    Queue one artifact. image is a PIL image, an OpenCV array (must not be modified
+    afterwards) or a callable returning one - callables run on the writer thread.
+    Returns the path it will be written to, or None if the stage is not selected.
+    """
+    if not wants_stage(filename):
+        return None
+    ext = ".jpg" if debug_settings["image_format"] == "jpg" else ".png"
+    path = os.path.join(debug_dir, os.path.splitext(filename)[0] + ext)
+    _ensure_worker()
+    _queue.put((path, image, dict(debug_settings), logger))
+    return path
+
+
+def flush_debug_images():
+    """Block until every queued artifact is on disk (call before exiting a worker process)"""
+    if _worker is not None:
+        _queue.join()
+
+
+# Queued artifacts still get written when the program exits normally
+atexit.register(flush_debug_images)
@@ -0,0 +1,134 @@
+"""
+Persistent detection cache.
+
+Maps (template content hash, detection parameters, detection version) to the
+cell_infos list, so re-opening an unchanged sheet skips OpenCV entirely.
+Stored as a small SQLite file in the user's cache directory.
+"""
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+def default_cache_dir():
+    """Per-user cache folder (override with EMOTE_TOOL_CACHE_DIR)"""
+    override = os.environ.get("EMOTE_TOOL_CACHE_DIR")
+    if override:
+        return override
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~\\AppData\\Local")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "EmoteTool")
+
+
+def make_key(content_hash, params, version):
+    """Stable text key from the hash, the detection parameters and the detection version"""
+    return f"{version}:{content_hash}:{json.dumps(params, sort_keys=True)}"
+
+
+class DetectionCache:
+    """SQLite-backed cell_infos cache with least-recently-used eviction"""
+
+    def __init__(self, path=None, max_entries=500):
+        self.path = path or os.path.join(default_cache_dir(), "detection_cache.sqlite3")
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS detections ("
+                "key TEXT PRIMARY KEY, cell_infos TEXT NOT NULL, last_used REAL NOT NULL)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        # Short-lived connections: safe across threads and the CLI's worker processes
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key):
+        """Return cached cell_infos for key, or None on a miss"""
+        with self._lock:
+            try:
+                with self._connect() as conn:
+                    row = conn.execute("SELECT cell_infos FROM detections WHERE key = ?", (key,)).fetchone()
+                    if row is not None:
+                        conn.execute("UPDATE detections SET last_used = ? WHERE key = ?", (time.time(), key))
+            except sqlite3.Error:
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        cell_infos = json.loads(row[0])
+        # JSON turns tuples into lists - restore the rect tuples callers expect
+        for cell in cell_infos:
+            cell["rect"] = tuple(cell["rect"])
+        return cell_infos
+
+    def put(self, key, cell_infos):
+        """Store cell_infos for key and evict the least recently used entries past max_entries"""
+        with self._lock:
+            try:
+                with self._connect() as conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO detections (key, cell_infos, last_used) VALUES (?, ?, ?)",
+                        (key, json.dumps(cell_infos), time.time()),
+                    )
+                    conn.execute(
+                        "DELETE FROM detections WHERE key NOT IN "
+                        "(SELECT key FROM detections ORDER BY last_used DESC LIMIT ?)",
+                        (self.max_entries,),
+                    )
+            except sqlite3.Error:
+                # A cache that can't be written is just a cache miss next time
+                pass
+
+    def clear(self):
+        """Invalidate every cached detection"""
+        with self._lock:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM detections")
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Hit/miss counts for this process plus the number of stored entries"""
+        with self._lock:
+            try:
+                with self._connect() as conn:
+                    entries = conn.execute("SELECT COUNT(*) FROM detections").fetchone()[0]
+            except sqlite3.Error:
+                entries = 0
+            return {"hits": self.hits, "misses": self.misses, "entries": entries, "path": self.path}
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_detection_cache():
+    """Shared per-process cache instance, or None if the cache folder can't be used"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            try:
+                _default_cache = DetectionCache()
+            except (OSError, sqlite3.Error):
+                return None
+        return _default_cache
@@ -1,8 +1,20 @@
 import customtkinter as ctk
 from tkinter import filedialog
-from PIL import Image
 import webbrowser
+import threading
 import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Edge length of the per-emote thumbnails in the naming panel
+THUMB_SIZE = 40
+
+# Export destination choices -> core export target
+EXPORT_TARGET_LABELS = {
+    "Folder": "folder",
+    "One ZIP": "zip",
+    "ZIP per Platform": "platform_zips",
+}
 
 
 class EmoteGUI:
@@ -20,12 +32,22 @@ class EmoteGUI:
         self.youtube_var = ctk.StringVar(value="off")
         self.discord_var = ctk.StringVar(value="off")
         self.debug_var = ctk.StringVar(value="off")
+        self.export_target_var = ctk.StringVar(value="Folder")
         
         # Store data between detection and export phases
         self.current_filename = None
+        self.current_template = None
         self.name_entries = []
         self.preview_window = None
         
+        # Detection and export run here so the Tk main thread never blocks
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.busy = False
+        self.cancel_event = None
+        self.export_progress = (0, 0)  # (files done, files total), written by the worker
+        self.export_report = []  # per-file results of the last export
+        self.export_unit = "files"  # what export progress counts
+        
         self.setup_ui()
     
     def center_window(self):
@@ -48,12 +70,12 @@ class EmoteGUI:
         file_frame = ctk.CTkFrame(self.app)
         file_frame.place(x=20, y=15, relwidth=0.9)
         
-        file_btn = ctk.CTkButton(
+        self.file_btn = ctk.CTkButton(
             file_frame, text="Select PNG", 
             command=self.open_file_dialog,
             width=100, height=30
         )
-        file_btn.pack(pady=5)
+        self.file_btn.pack(pady=5)
         
         # Platform selection checkboxes
         self.create_checkboxes()
@@ -73,6 +95,10 @@ class EmoteGUI:
         )
         cancel_btn.place(x=200, y=290)
         
+        # Shows what the background worker is doing
+        self.status_label = ctk.CTkLabel(self.app, text="", font=ctk.CTkFont(size=11))
+        self.status_label.place(x=20, y=322)
+        
         # Credits footer
         credits_frame = ctk.CTkFrame(self.app, height=25)
         credits_frame.place(x=0, y=350, relwidth=1.0)
@@ -103,19 +129,35 @@ class EmoteGUI:
             )
             checkbox.place(x=20, y=60 + i * 35)
     
+    def poll_future(self, future, on_done, on_tick=None):
+        """Check a background job from the Tk main thread and hand its result back once done"""
+        if future.done():
+            on_done(future)
+            return
+        if on_tick is not None:
+            on_tick()
+        self.app.after(50, lambda: self.poll_future(future, on_done, on_tick))
+    
+    def set_busy(self, busy, status=""):
+        """Block new jobs while one is running and show what is happening"""
+        self.busy = busy
+        self.file_btn.configure(state="disabled" if busy else "normal")
+        self.status_label.configure(text=status)
+    
     def open_file_dialog(self):
         """Handle file selection and trigger detection"""
-        from core import detect_emotes_with_rects
+        if self.busy:
+            return
         
         filename = filedialog.askopenfilename(
             title="Select PNG file",
-            filetypes=[("PNG files", "*.png"), ("All files", "*.*")]
+            filetypes=[("Templates", "*.png *.gif *.webp"), ("All files", "*.*")]
         )
         
-        # Validate PNG file type - other formats won't work correctly
-        if not filename or not filename.lower().endswith(".png"):
+        # Validate file type - other formats won't work correctly (GIF/WebP/APNG may be animated)
+        if not filename or not filename.lower().endswith((".png", ".gif", ".webp")):
             if filename:
-                error_label = ctk.CTkLabel(self.app, text="Please select PNG only!", text_color="red")
+                error_label = ctk.CTkLabel(self.app, text="Please select PNG, GIF or WebP only!", text_color="red")
                 error_label.pack()
                 error_label.after(3000, error_label.destroy)  # Auto-remove after 3 seconds
             return
@@ -125,9 +167,37 @@ class EmoteGUI:
         # Pass debug flag to detection
         debug_enabled = self.debug_var.get() == "on"
         
-        # Run detection and show results
-        marked_img, cell_infos = detect_emotes_with_rects(filename, debug_enabled)
+        # Run detection in the background, show results once it's done
+        # Preview fits 70% of the screen - asked here, widgets can't be queried from the worker
+        preview_box = (int(self.app.winfo_screenwidth() * 0.7), int(self.app.winfo_screenheight() * 0.7))
+        
+        self.set_busy(True, "Detecting emotes...")
+        future = self.executor.submit(self.detect_worker, filename, debug_enabled, preview_box)
+        self.poll_future(future, self.on_detection_done)
+    
+    @staticmethod
+    def detect_worker(filename, debug_enabled, preview_box):
+        """Runs on the worker thread - must not touch any widget"""
+        from core import detect_emotes_with_rects, load_template
+        
+        # Decode once - export reuses the same pixels
+        template = load_template(filename)
+        # Borders are drawn straight onto a preview sized copy, never at full resolution
+        marked_img, cell_infos = detect_emotes_with_rects(
+            template, debug_enabled, preview_size=preview_box, preview_max_scale=0.45
+        )
+        return template, marked_img, cell_infos
+    
+    def on_detection_done(self, future):
+        """Back on the Tk main thread with the detection result"""
+        try:
+            template, marked_img, cell_infos = future.result()
+        except Exception as e:
+            self.set_busy(False, f"Detection failed: {e}")
+            return
         
+        self.set_busy(False)
+        self.current_template = template
         self.show_preview_window(marked_img, cell_infos)
     
     def show_preview_window(self, marked_img, cell_infos):
@@ -143,21 +213,10 @@ class EmoteGUI:
         self.preview_window = ctk.CTkToplevel(self.app)
         self.preview_window.title(f"Emote Detection - {filled_count}/{total_cells} filled")
 
-        # === Smart Image Scaling ===
-        # Scale image to fit 70% of screen while maintaining aspect ratio
-        screen_width = self.preview_window.winfo_screenwidth()
-        screen_height = self.preview_window.winfo_screenheight()
-        max_img_width = int(screen_width * 0.7)
-        max_img_height = int(screen_height * 0.7)
-
-        orig_width, orig_height = marked_img.size
-        scale = min(max_img_width / orig_width, max_img_height / orig_height, 0.45)
-        preview_width = int(orig_width * scale)
-        preview_height = int(orig_height * scale)
-
-        # LANCZOS provides best quality for preview downscaling
-        preview_img = marked_img.resize((preview_width, preview_height), Image.Resampling.LANCZOS)
-        photo = ctk.CTkImage(light_image=preview_img, dark_image=preview_img, size=(preview_width, preview_height))
+        # === Preview Image ===
+        # Detection already rendered it at preview scale (fits 70% of screen, max 45%)
+        preview_width, preview_height = marked_img.size
+        photo = ctk.CTkImage(light_image=marked_img, dark_image=marked_img, size=(preview_width, preview_height))
 
         # === Left Panel: Preview Image ===
         left_frame = ctk.CTkFrame(self.preview_window)
@@ -184,10 +243,16 @@ class EmoteGUI:
 
         # Create numbered input field for each filled cell
         self.name_entries = []
+        self.thumb_rows = []
+        self.thumb_cache = {}
         for cell in filled_cells:
             row_frame = ctk.CTkFrame(naming_scroll)
             row_frame.pack(pady=5, fill="x")
 
+            # Thumbnail placeholder - filled in once the row scrolls into view
+            thumb_label = ctk.CTkLabel(row_frame, text="", width=THUMB_SIZE, height=THUMB_SIZE)
+            thumb_label.pack(side="left", padx=(5, 0))
+
             # Show emote number from detection
             label = ctk.CTkLabel(row_frame, text=f"#{cell['id']}:", width=40)
             label.pack(side="left", padx=5)
@@ -197,25 +262,85 @@ class EmoteGUI:
 
             # Store tuple of cell data + entry widget for export phase
             self.name_entries.append((cell, entry))
+            self.thumb_rows.append((cell, row_frame, thumb_label))
+        
+        self.naming_scroll = naming_scroll
+        self.app.after(50, self.load_visible_thumbnails)
 
+        # Where the files go: loose PNGs or streamed straight into ZIP(s)
+        # Animated sheets always export GIFs into the folder
+        if self.current_template.frame_count == 1:
+            target_menu = ctk.CTkOptionMenu(
+                right_frame, values=list(EXPORT_TARGET_LABELS),
+                variable=self.export_target_var, width=150
+            )
+            target_menu.pack(pady=(15, 0))
+        
         # Export button at bottom
-        export_btn = ctk.CTkButton(
+        self.export_btn = ctk.CTkButton(
             right_frame,
             text="Export Emotes",
             command=self.export_emotes,
             width=150, height=40
         )
-        export_btn.pack(pady=15)
+        self.export_btn.pack(pady=(10, 5))
+        
+        # Progress of a running export, fed by core's per-file callback
+        self.progress_bar = ctk.CTkProgressBar(right_frame, width=150)
+        self.progress_bar.set(0)
+        self.progress_bar.pack(pady=5)
+        
+        self.progress_label = ctk.CTkLabel(right_frame, text="", font=ctk.CTkFont(size=11))
+        self.progress_label.pack()
+        
+        self.stop_btn = ctk.CTkButton(
+            right_frame,
+            text="Stop Export",
+            command=self.stop_export,
+            width=150, height=30,
+            state="disabled"
+        )
+        self.stop_btn.pack(pady=(5, 15))
         
         # Size window to fit content
         self.preview_window.update_idletasks()
-        window_width = preview_width + 300
-        window_height = preview_height + 100
+        window_width = preview_width + 350
+        window_height = preview_height + 200
         self.preview_window.geometry(f"{window_width}x{window_height}")
     
+    def load_visible_thumbnails(self):
+        """Create thumbnails only for rows currently scrolled into view, keep polling while the window lives"""
+        from core import cell_thumbnail
+        
+        if self.preview_window is None or not self.preview_window.winfo_exists():
+            return
+        
+        # Visible slice of the scroll frame, in pixels of its inner height
+        inner_height = max(self.naming_scroll.winfo_height(), 1)
+        top, bottom = self.naming_scroll._parent_canvas.yview()
+        view_top, view_bottom = top * inner_height, bottom * inner_height
+        
+        for cell, row_frame, thumb_label in self.thumb_rows:
+            if cell["id"] in self.thumb_cache:
+                continue
+            row_top = row_frame.winfo_y()
+            if row_top + row_frame.winfo_height() < view_top or row_top > view_bottom:
+                continue
+            thumb = cell_thumbnail(self.current_template, cell["rect"], THUMB_SIZE)
+            photo = ctk.CTkImage(light_image=thumb, dark_image=thumb, size=(THUMB_SIZE, THUMB_SIZE))
+            self.thumb_cache[cell["id"]] = photo  # Keep reference to prevent garbage collection
+            thumb_label.configure(image=photo)
+        
+        if len(self.thumb_cache) < len(self.thumb_rows):
+            self.app.after(100, self.load_visible_thumbnails)
+    
     def export_emotes(self):
         """Gather settings and trigger export process"""
         from core import export_emotes
+        from animated import export_animated_emotes
+        
+        if self.busy:
+            return
         
         # Collect selected platforms from checkboxes
         selected_platforms = []
@@ -243,7 +368,74 @@ class EmoteGUI:
         debug_enabled = self.debug_var.get() == "on"
         name_list = [(cell, entry.get()) for cell, entry in self.name_entries]
         
-        exported_count, out_dir = export_emotes(self.current_filename, name_list, selected_platforms, debug_enabled)
+        # Export on the worker thread; progress and result come back through poll_future
+        self.cancel_event = threading.Event()
+        self.export_progress = (0, 0)
+        self.export_report = []
+        self.set_busy(True, "Exporting...")
+        self.export_btn.configure(state="disabled")
+        self.stop_btn.configure(state="normal")
+        self.progress_bar.set(0)
+        
+        if self.current_template.frame_count > 1:
+            # Animated sheet: frames are streamed, progress counts frames instead of files
+            self.export_unit = "frames"
+            future = self.executor.submit(
+                export_animated_emotes, self.current_template, name_list, selected_platforms, "gif", debug_enabled,
+                progress_callback=self.on_export_progress, cancel_event=self.cancel_event, report=self.export_report
+            )
+        else:
+            self.export_unit = "files"
+            future = self.executor.submit(
+                export_emotes, self.current_template, name_list, selected_platforms, debug_enabled,
+                progress_callback=self.on_export_progress, cancel_event=self.cancel_event,
+                target=EXPORT_TARGET_LABELS[self.export_target_var.get()], report=self.export_report
+            )
+        self.poll_future(future, self.on_export_done, self.update_export_progress)
+    
+    def on_export_progress(self, done, total):
+        """Called from the worker thread - only store the numbers, the poller draws them"""
+        self.export_progress = (done, total)
+    
+    def update_export_progress(self):
+        """Redraw the progress bar on the Tk main thread"""
+        if self.preview_window is None or not self.preview_window.winfo_exists():
+            return
+        done, total = self.export_progress
+        if total:
+            self.progress_bar.set(done / total)
+            self.progress_label.configure(text=f"{done}/{total} {self.export_unit}")
+    
+    def stop_export(self):
+        """Ask the running export to stop after the files in flight"""
+        if self.cancel_event is not None:
+            self.cancel_event.set()
+            self.stop_btn.configure(state="disabled")
+            self.status_label.configure(text="Stopping export...")
+    
+    def on_export_done(self, future):
+        """Back on the Tk main thread once the export finished or was stopped"""
+        cancelled = self.cancel_event is not None and self.cancel_event.is_set()
+        self.set_busy(False)
+        self.update_export_progress()
+        
+        if self.preview_window is not None and self.preview_window.winfo_exists():
+            self.export_btn.configure(state="normal")
+            self.stop_btn.configure(state="disabled")
+        
+        try:
+            exported_count, output = future.result()
+        except Exception as e:
+            self.status_label.configure(text=f"Export failed: {e}")
+            return
+        
+        if cancelled:
+            if not output:
+                # ZIP targets drop their partial archives, so nothing is left on disk
+                self.status_label.configure(text="Export stopped - partial ZIP deleted")
+            else:
+                self.status_label.configure(text=f"Export stopped - {exported_count} files done")
+            return
         
         # Show success message with file count and location
         success_window = ctk.CTkToplevel(self.app)
@@ -251,7 +443,16 @@ class EmoteGUI:
         success_window.geometry("300x200")
         
         ctk.CTkLabel(success_window, text=f"Exported {exported_count} files!").pack(pady=10)
-        ctk.CTkLabel(success_window, text=f"Location: {out_dir}", wraplength=280).pack(pady=5)
+        
+        # Re-exports into the same folder only rewrite what changed
+        skipped = sum(1 for r in self.export_report if r["status"] == "skipped")
+        if skipped:
+            rewritten = sum(1 for r in self.export_report if r["status"] == "written")
+            ctk.CTkLabel(success_window, text=f"{rewritten} rewritten, {skipped} unchanged").pack()
+        if isinstance(output, dict):
+            # One ZIP per platform, all next to the template
+            output = ", ".join(os.path.basename(path) for path in output.values())
+        ctk.CTkLabel(success_window, text=f"Location: {output}", wraplength=280).pack(pady=5)
     
         def close_all():
             """Close app after export confirmation"""
@@ -262,6 +463,10 @@ class EmoteGUI:
     
     def on_cancel(self):
         """Clean up and close application"""
+        # Stop a running export and drop queued work so the process can exit
+        if self.cancel_event is not None:
+            self.cancel_event.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
         if self.preview_window:
             self.preview_window.destroy()
         self.app.destroy()
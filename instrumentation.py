@@ -0,0 +1,180 @@
+"""
+Lightweight per-stage timing and memory instrumentation.
+
+Pass a Trace to detect_emotes_with_rects / export_emotes to get wall time (and
+optionally memory) for every stage: decode, gray, blur, canny, dilate/erode,
+contours, content check, each resize and each encode.
+
+    trace = Trace(memory=True)
+    detect_emotes_with_rects("sheet.png", trace=trace)
+    print(trace.summary())
+    trace.save_chrome_trace("sheet.trace.json")  # open in chrome://tracing or Perfetto
+
+Functions registered with add_trace_hook receive every finished span, traced or
+not - that's the place to plug in your own metrics collector.
+"""
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+_hooks = []
+_local = threading.local()
+
+
+def add_trace_hook(hook):
+    """Call hook(span_dict) for every finished stage, in every thread"""
+    _hooks.append(hook)
+
+
+def remove_trace_hook(hook):
+    if hook in _hooks:
+        _hooks.remove(hook)
+
+
+def current_rss():
+    """Resident memory of this process in bytes, or None where it can't be read cheaply"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class Trace:
+    """
+    Collects stage spans. Thread-safe, so export's resize/encode threads can share one.
+    memory=True turns on tracemalloc: each span gets the peak of Python/NumPy/OpenCV
+    allocations while it ran (process wide, Pillow's own buffers are not seen) plus RSS.
+    Concurrent spans would mix up that single peak, so traced thread pools shrink to one
+    thread with memory=True (see pool_size) - the trace's notes say so.
+    """
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.spans = []
+        self.notes = []
+        self.origin = time.perf_counter_ns()
+        self._lock = threading.Lock()
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def note(self, text):
+        """Remark stored with the trace (once), e.g. how it was measured"""
+        with self._lock:
+            if text not in self.notes:
+                self.notes.append(text)
+
+    def pool_size(self, max_workers):
+        """
+        Threads a traced stage pool may use. tracemalloc keeps one peak for the whole process,
+        so with memory=True spans running side by side would reset and count each other's
+        allocations - the pool runs on one thread instead (slower, but every alloc_peak is its own).
+        """
+        if not self.memory:
+            return max_workers
+        self.note("memory tracing: thread pools ran on 1 thread, so each span's alloc_peak only covers that span")
+        return 1
+
+    def to_dict(self):
+        """Structured result: every span plus the per-stage summary"""
+        with self._lock:
+            spans = list(self.spans)
+            notes = list(self.notes)
+        return {"spans": spans, "summary": self.summary(), "notes": notes}
+
+    def summary(self):
+        """Per stage name: call count, total and max wall time (ms), max allocation peak"""
+        stages = {}
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            stage = stages.setdefault(span["name"], {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "alloc_peak": None})
+            stage["count"] += 1
+            stage["total_ms"] += span["duration_ms"]
+            stage["max_ms"] = max(stage["max_ms"], span["duration_ms"])
+            if span.get("alloc_peak") is not None:
+                stage["alloc_peak"] = max(stage["alloc_peak"] or 0, span["alloc_peak"])
+        return stages
+
+    def save_json(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=1)
+
+    def save_chrome_trace(self, path):
+        """Chrome trace event format - load in chrome://tracing or ui.perfetto.dev"""
+        with self._lock:
+            spans = list(self.spans)
+            notes = list(self.notes)
+        pid = os.getpid()
+        events = []
+        for span in spans:
+            args = {k: v for k, v in span.items() if k not in ("name", "start_ms", "duration_ms", "thread")}
+            events.append({
+                "name": span["name"],
+                "ph": "X",
+                "ts": span["start_ms"] * 1000.0,
+                "dur": span["duration_ms"] * 1000.0,
+                "pid": pid,
+                "tid": span["thread"],
+                "args": args,
+            })
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"notes": notes}}, f)
+
+
+@contextmanager
+def stage(trace, name, **details):
+    """
+    Time one stage. With no trace and no hooks this only costs a couple of attribute lookups.
+    Extra keyword details (sizes, counts, ...) are stored on the span.
+    """
+    if trace is None and not _hooks:
+        yield
+        return
+
+    memory = trace is not None and trace.memory and tracemalloc.is_tracing()
+    # Nested stages share tracemalloc's single peak counter: children report their
+    # absolute peak to the parent so resetting it inside a child loses nothing
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    frame = {"child_peak": 0}
+    if memory:
+        alloc_start = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+    stack.append(frame)
+
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        end = time.perf_counter_ns()
+        stack.pop()
+
+        origin = trace.origin if trace is not None else start
+        span = {
+            "name": name,
+            "start_ms": (start - origin) / 1e6,
+            "duration_ms": (end - start) / 1e6,
+            "thread": threading.get_ident(),
+        }
+        span.update(details)
+        if memory:
+            peak = max(tracemalloc.get_traced_memory()[1], frame["child_peak"])
+            if stack:
+                stack[-1]["child_peak"] = max(stack[-1]["child_peak"], peak)
+            span["alloc_peak"] = max(peak - alloc_start, 0)
+            span["rss"] = current_rss()
+
+        if trace is not None:
+            trace.add(span)
+        for hook in list(_hooks):
+            hook(span)
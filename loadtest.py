@@ -0,0 +1,204 @@
+"""
+Load test for the HTTP service (server.py) on localhost.
+
+Usage:
+    python -m server --workers 2 &
+    python loadtest.py --clients 8 --requests 40
+    python loadtest.py --start-server --workers 2 --clients 4 --requests 20 --export twitch discord
+    python loadtest.py --template my_sheet.png --by-path --output load.json
+
+Every client runs detect (upload, or --by-path) and then, with --export, a ZIP export
+of the same session. Prints latency percentiles, throughput and errors per endpoint,
+plus the server's own latency histograms from /health.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmark import make_synthetic_template
+
+
+def call(url, data=None, content_type=None, method=None, timeout=300):
+    """One request; returns (status, body, seconds) - HTTP errors are results, not exceptions"""
+    headers = {"Content-Type": content_type} if content_type else {}
+    request = urllib.request.Request(url, data=data, headers=headers, method=method)
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            body = response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        body = e.read()
+        status = e.code
+    except OSError as e:
+        body = str(e).encode()
+        status = 0
+    return status, body, time.perf_counter() - start
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else None
+
+
+class Recorder:
+    """Latencies and statuses per endpoint, shared by the client threads"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.statuses = {}
+
+    def add(self, endpoint, status, seconds):
+        with self.lock:
+            if 200 <= status < 300:
+                self.latencies.setdefault(endpoint, []).append(seconds * 1000)
+            counts = self.statuses.setdefault(endpoint, {})
+            counts[status] = counts.get(status, 0) + 1
+
+    def summary(self, wall):
+        result = {}
+        for endpoint in sorted(self.statuses):
+            ms = self.latencies.get(endpoint, [])
+            total = sum(self.statuses[endpoint].values())
+            result[endpoint] = {
+                "requests": total,
+                "ok": len(ms),
+                "statuses": {str(k): v for k, v in sorted(self.statuses[endpoint].items())},
+                "per_second": round(len(ms) / wall, 2),
+                "mean_ms": round(sum(ms) / len(ms), 1) if ms else None,
+                "p50_ms": round(percentile(ms, 0.5), 1) if ms else None,
+                "p95_ms": round(percentile(ms, 0.95), 1) if ms else None,
+                "p99_ms": round(percentile(ms, 0.99), 1) if ms else None,
+                "max_ms": round(max(ms), 1) if ms else None,
+            }
+        return result
+
+
+def run_client_request(base_url, template, by_path, platforms, recorder):
+    """detect, then export the session (if platforms), then drop it"""
+    if by_path:
+        status, body, seconds = call(f"{base_url}/detect", json.dumps({"path": template}).encode(), "application/json")
+    else:
+        with open(template, "rb") as f:
+            status, body, seconds = call(f"{base_url}/detect", f.read(), "application/octet-stream")
+    recorder.add("detect", status, seconds)
+    if status != 200:
+        return
+    session = json.loads(body)["session"]
+
+    if platforms:
+        request = {"session": session, "platforms": platforms}
+        status, body, seconds = call(f"{base_url}/export", json.dumps(request).encode(), "application/json")
+        recorder.add("export", status, seconds)
+    call(f"{base_url}/sessions/{session}", method="DELETE")
+
+
+def wait_for_server(base_url, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status, _, _ = call(f"{base_url}/health", timeout=2)
+        if status == 200:
+            return True
+        time.sleep(0.5)
+    return False
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="loadtest", description="Load test the local HTTP service.")
+    parser.add_argument("--url", default="http://127.0.0.1:8765", help="Server address (default: http://127.0.0.1:8765)")
+    parser.add_argument("--template", help="Template to send (default: a generated sheet with most cells filled)")
+    parser.add_argument("--by-path", action="store_true", help="Send the template's path instead of uploading it")
+    parser.add_argument("-c", "--clients", type=int, default=4, help="Concurrent clients (default: 4)")
+    parser.add_argument("-n", "--requests", type=int, default=20, help="detect (+ export) rounds in total (default: 20)")
+    parser.add_argument("--export", nargs="*", metavar="PLATFORM",
+                        help="Also export every session as a ZIP (default platform: twitch)")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed rounds before measuring (default: 1)")
+    parser.add_argument("--start-server", action="store_true", help="Start python -m server on --url's port for the run")
+    parser.add_argument("-w", "--workers", type=int, default=2, help="Server workers with --start-server (default: 2)")
+    parser.add_argument("--output", help="Write the results as JSON")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    base_url = args.url.rstrip("/")
+    platforms = (args.export or ["twitch"]) if args.export is not None else []
+
+    # The shipped templates are empty - exporting them would time a ZIP with no emotes in it
+    work_dir = None
+    if args.template:
+        template = os.path.abspath(args.template)
+    else:
+        work_dir = tempfile.mkdtemp(prefix="emote_loadtest_")
+        template = os.path.join(work_dir, "template.png")
+        make_synthetic_template()[0].save(template)
+
+    server = None
+    if args.start_server:
+        port = base_url.rsplit(":", 1)[-1]
+        server = subprocess.Popen(
+            [sys.executable, "-m", "server", "--port", port, "--workers", str(args.workers)],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+    try:
+        if not wait_for_server(base_url, 120 if server else 5):
+            print(f"No server answering at {base_url}", file=sys.stderr)
+            return 1
+
+        for _ in range(args.warmup):
+            run_client_request(base_url, template, args.by_path, platforms, Recorder())
+
+        print(f"{args.requests} round(s), {args.clients} client(s), {'export ' + ' '.join(platforms) if platforms else 'detect only'}")
+        recorder = Recorder()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.clients) as pool:
+            futures = [
+                pool.submit(run_client_request, base_url, template, args.by_path, platforms, recorder)
+                for _ in range(args.requests)
+            ]
+            for future in futures:
+                future.result()
+        wall = time.perf_counter() - start
+
+        results = {"wall_s": round(wall, 2), "clients": args.clients, "endpoints": recorder.summary(wall)}
+        for endpoint, r in results["endpoints"].items():
+            print(
+                f"{endpoint:>7}: {r['ok']}/{r['requests']} ok, {r['per_second']}/s, "
+                f"p50 {r['p50_ms']} ms, p95 {r['p95_ms']} ms, p99 {r['p99_ms']} ms, max {r['max_ms']} ms  {r['statuses']}"
+            )
+        print(f"Wall time {wall:.2f}s")
+
+        status, body, _ = call(f"{base_url}/health")
+        if status == 200:
+            health = json.loads(body)
+            results["server"] = health
+            print(f"Server: {health['workers']} worker(s), {health['worker_restarts']} restart(s)")
+            for endpoint, h in health["latency"].items():
+                print(f"  {endpoint:>14}: {h['count']} requests, p50 <= {h['p50_ms']} ms, p95 <= {h['p95_ms']} ms")
+
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+            print(f"Results written to {args.output}")
+        failed = sum(r["requests"] - r["ok"] for r in results["endpoints"].values())
+        return 1 if failed else 0
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        if work_dir is not None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
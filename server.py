@@ -0,0 +1,731 @@
+"""
+Local HTTP service: detection and export for other tools, without the GUI.
+
+Usage:
+    python -m server --port 8765 --workers 2
+
+Endpoints (JSON in and out unless noted):
+    POST   /detect            body: the template file (PNG/GIF/WebP), or {"path": "..."} for a file on this machine
+                              (path mode only for clients connecting from this machine)
+                              query: engine, preview (long side in px, default 512), memory_budget (MB)
+                              -> {"session", "width", "height", "frame_count", "cell_infos", "preview" (base64 PNG)}
+    POST   /export            {"session", "platforms", "names", "encoding", "resampler", "animated_format", "async"}
+                              -> the ZIP (application/zip), or 202 {"job"} when "async" is true
+    GET    /jobs/<id>         -> {"job", "state": "queued" | "running" | "done" | "failed" | "cancelled", "error"}
+    GET    /jobs/<id>/result  -> the ZIP once the job is done
+    DELETE /sessions/<id>     drop a session (idle sessions also expire after SESSION_TTL seconds)
+    GET    /health            -> status, workers, sessions, jobs and latency histograms per endpoint
+
+Workers are started and warmed up (cv2/numpy/PIL imported, first calls made)
+before the server accepts requests. Every session is pinned to one worker, whose
+template cache keeps the decoded sheet - exporting after detect doesn't decode it again.
+At most --max-requests detect/export requests are worked on at once; the rest wait
+up to --queue-timeout seconds and then get 503.
+"""
+import argparse
+import base64
+import io
+import ipaddress
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import core
+from animated import ANIMATED_FORMATS, export_animated_emotes
+from cli import megabytes, parse_names
+from core import (
+    DETECTION_ENGINES, ENCODING_PROFILES, RESAMPLERS, detect_emotes_with_rects, export_emotes, is_template_cached,
+    load_template, platform_sizes,
+)
+from watch import setup_service_logging
+
+
+DEFAULT_PORT = 8765
+# Seconds a request waits for a free slot before it gets 503
+QUEUE_TIMEOUT = 30.0
+# Idle sessions and finished jobs are dropped after these many seconds
+SESSION_TTL = 15 * 60
+JOB_TTL = 15 * 60
+MAX_SESSIONS = 64
+DEFAULT_PREVIEW_SIDE = 512
+MAX_PREVIEW_SIDE = 4096
+
+# Request latency histogram buckets (upper bounds in ms)
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+UPLOAD_TYPES = {b"\x89PNG\r\n\x1a\n": ".png", b"GIF87a": ".gif", b"GIF89a": ".gif"}
+
+log = logging.getLogger("emote_server")
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# === Worker process side ===
+
+def init_worker(templates_per_worker):
+    """Runs once in every worker: room for the decoded templates of its sessions"""
+    core.TEMPLATE_CACHE_MAX_ENTRIES = templates_per_worker
+
+
+def warm_up():
+    """First calls into OpenCV and Pillow set up thread pools and codecs - pay for that before the first request"""
+    gray = cv2.GaussianBlur(np.zeros((64, 64), dtype=np.uint8), (5, 5), 0)
+    cv2.findContours(cv2.Canny(gray, 40, 120), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    Image.new("RGBA", (64, 64)).resize((32, 32), Image.Resampling.LANCZOS).save(io.BytesIO(), format="PNG")
+    return os.getpid()
+
+
+def detect_task(path, engine, preview_side, memory_budget):
+    reused = is_template_cached(path)
+    template = load_template(path)
+    preview, cell_infos = detect_emotes_with_rects(
+        template, engine=engine, preview_size=(preview_side, preview_side), memory_budget=memory_budget,
+    )
+    buffer = io.BytesIO()
+    preview.save(buffer, format="PNG")
+    return {
+        "width": template.width,
+        "height": template.height,
+        "frame_count": template.frame_count,
+        "cell_infos": cell_infos,
+        "preview": buffer.getvalue(),
+        "reused": reused,
+        "worker": os.getpid(),
+    }
+
+
+def zip_folder(folder):
+    """Every exported file in folder as one stored ZIP (the files are compressed images already)"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+        for name in sorted(os.listdir(folder)):
+            # The static part of an animated export leaves its incremental manifest behind - not for clients
+            if name.endswith(core.MANIFEST_SUFFIX):
+                continue
+            archive.write(os.path.join(folder, name), name)
+    return buffer.getvalue()
+
+
+def export_task(path, cell_infos, names, platforms, encoding, resampler, animated_format):
+    reused = is_template_cached(path)
+    template = load_template(path)
+    name_entries = [(cell, names.get(cell["id"], "")) for cell in cell_infos if cell["has_content"]]
+    if template.frame_count > 1:
+        # Animated export writes files - collect them from a scratch folder
+        with tempfile.TemporaryDirectory(prefix="emote_export_") as scratch:
+            count, out_dir = export_animated_emotes(
+                template, name_entries, platforms, image_format=animated_format, output_dir=scratch,
+                resampler=resampler,
+            )
+            data = zip_folder(out_dir)
+    else:
+        count, data = export_emotes(
+            template, name_entries, platforms, encoding=encoding, target="zip", in_memory=True, incremental=False,
+            output_dir=os.path.dirname(path), resampler=resampler,
+        )
+    return {"files": count, "zip": data, "reused": reused, "worker": os.getpid()}
+
+
+# === Server side ===
+
+def _worker_context():
+    """Workers fork from a server process that already imported everything (spawn where fork isn't available)"""
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["server"])
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+class WorkerPool:
+    """
+    Warm worker processes with one executor each, so everything of a session
+    runs in the same process (and finds its decoded template there).
+    """
+
+    def __init__(self, workers, templates_per_worker=4):
+        self.templates_per_worker = templates_per_worker
+        self.context = _worker_context()
+        self.lock = threading.Lock()
+        self.slots = [self._start() for _ in range(workers)]
+        # Set once a call on the slot's executor fails with BrokenExecutor (its process died)
+        self.broken = [False] * workers
+        self.load = [0] * workers
+        self.restarts = 0
+        # Start every process now and wait until it is warm
+        self.pids = [slot.submit(warm_up).result() for slot in self.slots]
+
+    def _start(self):
+        return ProcessPoolExecutor(
+            max_workers=1, mp_context=self.context, initializer=init_worker, initargs=(self.templates_per_worker,),
+        )
+
+    def pick(self, sessions):
+        """Worker for a new session: least work queued, then fewest sessions ({worker: count})"""
+        with self.lock:
+            return min(range(len(self.slots)), key=lambda i: (self.load[i], sessions.get(i, 0)))
+
+    def _mark_broken(self, index, executor):
+        with self.lock:
+            # A call on an executor that was replaced already says nothing about the new one
+            if self.slots[index] is executor:
+                self.broken[index] = True
+
+    def _done(self, index, executor, future):
+        with self.lock:
+            self.load[index] -= 1
+        if not future.cancelled() and isinstance(future.exception(), BrokenExecutor):
+            self._mark_broken(index, executor)
+
+    def _submit(self, index, fn, *args):
+        with self.lock:
+            executor = self.slots[index]
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenExecutor:
+            self._mark_broken(index, executor)
+            self.restart(index)
+            with self.lock:
+                executor = self.slots[index]
+            future = executor.submit(fn, *args)
+        with self.lock:
+            self.load[index] += 1
+        future.add_done_callback(lambda f: self._done(index, executor, f))
+        return executor, future
+
+    def submit(self, index, fn, *args):
+        """Queue fn on worker index; a crashed worker is replaced and the call submitted again"""
+        return self._submit(index, fn, *args)[1]
+
+    def run(self, index, fn, *args):
+        executor, future = self._submit(index, fn, *args)
+        try:
+            return future.result()
+        except BrokenExecutor:
+            # The worker died while running this call (e.g. out of memory) - one retry on a fresh one
+            self._mark_broken(index, executor)
+            self.restart(index)
+            return self.submit(index, fn, *args).result()
+
+    def restart(self, index):
+        with self.lock:
+            if not self.broken[index]:
+                # Someone else replaced it already
+                return
+            old = self.slots[index]
+            self.slots[index] = self._start()
+            self.broken[index] = False
+            self.restarts += 1
+        log.warning(f"Worker {index} crashed, started a new one")
+        old.shutdown(wait=False, cancel_futures=True)
+        self.pids[index] = self.slots[index].submit(warm_up).result()
+
+    def alive(self):
+        """Workers not known to have crashed (dead ones are replaced on their next call)"""
+        with self.lock:
+            return self.broken.count(False)
+
+    def close(self):
+        for slot in self.slots:
+            slot.shutdown(wait=True, cancel_futures=True)
+
+
+class LatencyHistogram:
+    """Request latencies in LATENCY_BUCKETS_MS buckets (the last one counts everything slower)"""
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms):
+        index = next((i for i, bound in enumerate(LATENCY_BUCKETS_MS) if ms <= bound), len(LATENCY_BUCKETS_MS))
+        self.buckets[index] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (None if nothing was observed)"""
+        if not self.count:
+            return None
+        seen = 0
+        for bound, n in zip(LATENCY_BUCKETS_MS, self.buckets):
+            seen += n
+            if seen >= q * self.count:
+                return bound
+        return self.max_ms
+
+    def as_dict(self):
+        labels = [f"le_{bound}" for bound in LATENCY_BUCKETS_MS] + ["inf"]
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total_ms / self.count, 2) if self.count else None,
+            "max_ms": round(self.max_ms, 2),
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "p99_ms": self.quantile(0.99),
+            "buckets": dict(zip(labels, self.buckets)),
+        }
+
+
+class Metrics:
+    """Latency histogram and status counts per endpoint"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = {}
+        self.statuses = {}
+
+    def observe(self, endpoint, status, ms):
+        with self.lock:
+            self.latency.setdefault(endpoint, LatencyHistogram()).observe(ms)
+            counts = self.statuses.setdefault(endpoint, {})
+            counts[str(status)] = counts.get(str(status), 0) + 1
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                endpoint: dict(histogram.as_dict(), statuses=dict(self.statuses[endpoint]))
+                for endpoint, histogram in sorted(self.latency.items())
+            }
+
+
+class EmoteService:
+    """Sessions, export jobs and the worker pool behind the HTTP handler"""
+
+    def __init__(self, workers=2, max_requests=None, templates_per_worker=4, max_upload=64 * 2**20,
+                 queue_timeout=QUEUE_TIMEOUT):
+        self.pool = WorkerPool(workers, templates_per_worker)
+        self.max_requests = max_requests or workers * 2
+        self.queue_timeout = queue_timeout
+        self.slots = threading.BoundedSemaphore(self.max_requests)
+        self.in_flight = 0
+        self.max_upload = max_upload
+        self.lock = threading.Lock()
+        self.sessions = {}   # id -> session dict
+        self.jobs = {}       # id -> job dict
+        self.metrics = Metrics()
+        self.started = time.time()
+        self.upload_dir = tempfile.mkdtemp(prefix="emote_server_")
+
+    @contextmanager
+    def admit(self):
+        """Concurrency limit for detect/export - waits queue_timeout seconds for a slot, then gives up"""
+        if not self.slots.acquire(timeout=self.queue_timeout):
+            raise HTTPError(503, f"Busy: {self.max_requests} requests already running")
+        with self.lock:
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+            self.slots.release()
+
+    # --- sessions ---
+
+    def _new_session(self, path, owned):
+        self.expire()
+        with self.lock:
+            per_worker = {}
+            for s in self.sessions.values():
+                per_worker[s["worker"]] = per_worker.get(s["worker"], 0) + 1
+        session = {
+            "id": uuid.uuid4().hex,
+            "path": path,
+            "owned": owned,
+            "worker": self.pool.pick(per_worker),
+            "cell_infos": None,
+            "last_used": time.monotonic(),
+            # Exports still reading the file - an upload outlives its dropped session until they finish
+            "users": 0,
+            "dropped": False,
+        }
+        with self.lock:
+            self.sessions[session["id"]] = session
+            # Over the limit: the least recently used sessions go first
+            while len(self.sessions) > MAX_SESSIONS:
+                oldest = min(self.sessions.values(), key=lambda s: s["last_used"])
+                self._drop(oldest["id"])
+        return session
+
+    def _session(self, session_id):
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                raise HTTPError(404, f"Unknown or expired session '{session_id}'")
+            session["last_used"] = time.monotonic()
+            return session
+
+    def _drop(self, session_id):
+        """Forget a session and delete its uploaded file once no export uses it (self.lock held)"""
+        session = self.sessions.pop(session_id, None)
+        if session is not None:
+            session["dropped"] = True
+            self._remove_upload(session)
+        return session is not None
+
+    def _remove_upload(self, session):
+        """self.lock held"""
+        if session["owned"] and session["dropped"] and not session["users"]:
+            shutil.rmtree(os.path.dirname(session["path"]), ignore_errors=True)
+
+    def _use(self, session):
+        """Keep the session's file on disk until _release - even if the session expires meanwhile"""
+        with self.lock:
+            if session["dropped"]:
+                raise HTTPError(404, f"Unknown or expired session '{session['id']}'")
+            session["users"] += 1
+
+    def _release(self, session):
+        with self.lock:
+            session["users"] -= 1
+            self._remove_upload(session)
+
+    def drop_session(self, session_id):
+        with self.lock:
+            if not self._drop(session_id):
+                raise HTTPError(404, f"Unknown or expired session '{session_id}'")
+
+    def expire(self):
+        now = time.monotonic()
+        with self.lock:
+            for session in [s for s in self.sessions.values() if now - s["last_used"] > SESSION_TTL]:
+                self._drop(session["id"])
+            for job in [j for j in self.jobs.values() if j["future"].done() and now - j["created"] > JOB_TTL]:
+                del self.jobs[job["id"]]
+
+    def _store_upload(self, body):
+        suffix = UPLOAD_TYPES.get(body[:8]) or UPLOAD_TYPES.get(body[:6])
+        if suffix is None and body[:4] == b"RIFF" and body[8:12] == b"WEBP":
+            suffix = ".webp"
+        if suffix is None:
+            raise HTTPError(415, "Expected a PNG, GIF or WebP template")
+        folder = tempfile.mkdtemp(dir=self.upload_dir)
+        path = os.path.join(folder, "template" + suffix)
+        with open(path, "wb") as f:
+            f.write(body)
+        return path
+
+    # --- endpoints ---
+
+    def detect(self, body, content_type, query, peer="127.0.0.1"):
+        engine = query.get("engine", "contours")
+        if engine not in DETECTION_ENGINES:
+            raise HTTPError(400, f"Unknown engine '{engine}', expected one of {sorted(DETECTION_ENGINES)}")
+        preview_side = min(int(query.get("preview", DEFAULT_PREVIEW_SIDE)), MAX_PREVIEW_SIDE)
+        memory_budget = megabytes(float(query["memory_budget"])) if "memory_budget" in query else None
+
+        path = None
+        if content_type.startswith("application/json"):
+            if not ipaddress.ip_address(peer).is_loopback:
+                # With --host on a network interface, path mode would hand out any image this process can read
+                raise HTTPError(403, "Detecting by path is only allowed from this machine - upload the file instead")
+            path = json.loads(body).get("path")
+            if not path or not os.path.isfile(path):
+                raise HTTPError(404, f"No such template: {path}")
+
+        with self.admit():
+            # Only admitted requests get a session (and keep their upload on disk)
+            if path is not None:
+                session = self._new_session(os.path.abspath(path), owned=False)
+            else:
+                session = self._new_session(self._store_upload(body), owned=True)
+            try:
+                result = self.pool.run(
+                    session["worker"], detect_task, session["path"], engine, preview_side, memory_budget,
+                )
+            except Exception as e:
+                with self.lock:
+                    self._drop(session["id"])
+                if isinstance(e, (OSError, SyntaxError)):
+                    # How Pillow reports broken files
+                    raise HTTPError(400, f"Can't read template: {e}") from e
+                raise
+        session["cell_infos"] = result["cell_infos"]
+        log.info(
+            f"detect {session['id'][:8]}: {len(result['cell_infos'])} cells on worker {result['worker']}"
+        )
+        return {
+            "session": session["id"],
+            "width": result["width"],
+            "height": result["height"],
+            "frame_count": result["frame_count"],
+            "cell_infos": result["cell_infos"],
+            "preview": base64.b64encode(result["preview"]).decode("ascii"),
+        }
+
+    def _export_args(self, request):
+        session = self._session(request.get("session"))
+        if session["cell_infos"] is None:
+            raise HTTPError(409, "Session has no detection yet")
+        platforms = request.get("platforms", ["twitch"])
+        unknown = [p for p in platforms if p not in platform_sizes]
+        if unknown:
+            raise HTTPError(400, f"Unknown platform(s) {unknown}, expected some of {sorted(platform_sizes)}")
+        encoding = request.get("encoding", "balanced")
+        resampler = request.get("resampler", "pil")
+        animated_format = request.get("animated_format", "gif")
+        if encoding not in ENCODING_PROFILES or resampler not in RESAMPLERS or animated_format not in ANIMATED_FORMATS:
+            raise HTTPError(400, "Unknown encoding, resampler or animated_format")
+        names = parse_names(request.get("names") or {})
+        args = (session["path"], session["cell_infos"], names, platforms, encoding, resampler, animated_format)
+        return session, args
+
+    def export(self, request):
+        """Returns the ZIP bytes, or the job dict for "async": true"""
+        session, args = self._export_args(request)
+        if request.get("async"):
+            with self.lock:
+                pending = sum(1 for j in self.jobs.values() if not j["future"].done())
+            if pending >= self.max_requests:
+                raise HTTPError(503, f"Busy: {pending} export jobs waiting")
+            self._use(session)
+            try:
+                future = self.pool.submit(session["worker"], export_task, *args)
+            except BaseException:
+                self._release(session)
+                raise
+            # The queued job owns the upload now: it stays until the job is finished
+            future.add_done_callback(lambda _: self._release(session))
+            job = {"id": uuid.uuid4().hex, "session": session["id"], "created": time.monotonic(), "future": future}
+            with self.lock:
+                self.jobs[job["id"]] = job
+            return job
+
+        with self.admit():
+            self._use(session)
+            try:
+                result = self.pool.run(session["worker"], export_task, *args)
+            finally:
+                self._release(session)
+        log.info(f"export {session['id'][:8]}: {result['files']} files on worker {result['worker']}"
+                 f"{' (template reused)' if result['reused'] else ''}")
+        return result["zip"]
+
+    def _job(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            raise HTTPError(404, f"Unknown or expired job '{job_id}'")
+        return job
+
+    def job_status(self, job_id):
+        job = self._job(job_id)
+        future = job["future"]
+        status = {"job": job["id"], "session": job["session"]}
+        if not future.done():
+            status["state"] = "running" if future.running() else "queued"
+        elif future.cancelled():
+            # Dropped from the queue (shutdown, or its worker was replaced)
+            status["state"] = "cancelled"
+        elif future.exception() is not None:
+            status.update(state="failed", error=str(future.exception()))
+        else:
+            status.update(state="done", files=future.result()["files"])
+        return status
+
+    def job_result(self, job_id):
+        future = self._job(job_id)["future"]
+        if not future.done():
+            raise HTTPError(409, "Job is not finished yet")
+        if future.cancelled():
+            raise HTTPError(410, "Job was cancelled")
+        if future.exception() is not None:
+            raise HTTPError(500, f"Job failed: {future.exception()}")
+        return future.result()["zip"]
+
+    def health(self):
+        with self.lock:
+            sessions = len(self.sessions)
+            jobs = sum(1 for j in self.jobs.values() if not j["future"].done())
+            in_flight = self.in_flight
+        alive = self.pool.alive()
+        return {
+            "status": "ok" if alive else "degraded",
+            "uptime_s": round(time.time() - self.started, 1),
+            "workers": len(self.pool.slots),
+            "workers_alive": alive,
+            "worker_pids": self.pool.pids,
+            "worker_restarts": self.pool.restarts,
+            "in_flight": in_flight,
+            "max_requests": self.max_requests,
+            "sessions": sessions,
+            "jobs_pending": jobs,
+            "latency": self.metrics.as_dict(),
+        }
+
+    def close(self):
+        self.pool.close()
+        shutil.rmtree(self.upload_dir, ignore_errors=True)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    server_version = "EmoteTool"
+    # Keep-alive, so clients (and the load test) reuse connections
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def _route(self, method, path):
+        """(endpoint name for metrics, handler, path argument)"""
+        parts = [p for p in path.split("/") if p]
+        if method == "POST" and parts == ["detect"]:
+            return "detect", self._detect, None
+        if method == "POST" and parts == ["export"]:
+            return "export", self._export, None
+        if method == "GET" and parts == ["health"]:
+            return "health", self._health, None
+        if method == "GET" and len(parts) == 2 and parts[0] == "jobs":
+            return "job", self._job_status, parts[1]
+        if method == "GET" and len(parts) == 3 and parts[0] == "jobs" and parts[2] == "result":
+            return "job_result", self._job_result, parts[1]
+        if method == "DELETE" and len(parts) == 2 and parts[0] == "sessions":
+            return "session_delete", self._session_delete, parts[1]
+        return "unknown", None, None
+
+    def _dispatch(self, method):
+        start = time.perf_counter()
+        service = self.server.service
+        url = urlsplit(self.path)
+        self.query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        endpoint, handler, argument = self._route(method, url.path)
+        try:
+            if handler is None:
+                raise HTTPError(404, f"No endpoint {method} {url.path}")
+            status, content_type, payload = handler(argument)
+        except HTTPError as e:
+            status, content_type, payload = e.status, "application/json", {"error": str(e)}
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            status, content_type, payload = 400, "application/json", {"error": f"Bad request: {e}"}
+        except Exception as e:
+            log.exception(f"{method} {url.path} failed")
+            status, content_type, payload = 500, "application/json", {"error": str(e)}
+        self._send(status, content_type, payload)
+        service.metrics.observe(endpoint, status, (time.perf_counter() - start) * 1000)
+
+    def _send(self, status, content_type, payload):
+        body = json.dumps(payload).encode("utf-8") if content_type == "application/json" else payload
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if status == 503:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        length = self.headers.get("Content-Length")
+        if length is None:
+            self.close_connection = True
+            raise HTTPError(411, "Content-Length required")
+        length = int(length)
+        if length > self.server.service.max_upload:
+            # The body is never read - the connection can't be reused
+            self.close_connection = True
+            raise HTTPError(413, f"Body over {self.server.service.max_upload} bytes")
+        return self.rfile.read(length)
+
+    def _detect(self, _):
+        body = self._read_body()
+        return 200, "application/json", self.server.service.detect(
+            body, self.headers.get("Content-Type", ""), self.query, self.client_address[0],
+        )
+
+    def _export(self, _):
+        request = json.loads(self._read_body() or b"{}")
+        result = self.server.service.export(request)
+        if isinstance(result, dict):
+            return 202, "application/json", {"job": result["id"], "session": result["session"]}
+        return 200, "application/zip", result
+
+    def _health(self, _):
+        return 200, "application/json", self.server.service.health()
+
+    def _job_status(self, job_id):
+        return 200, "application/json", self.server.service.job_status(job_id)
+
+    def _job_result(self, job_id):
+        return 200, "application/zip", self.server.service.job_result(job_id)
+
+    def _session_delete(self, session_id):
+        self.server.service.drop_session(session_id)
+        return 200, "application/json", {"deleted": session_id}
+
+    def log_message(self, format, *args):
+        log.debug(f"{self.address_string()} {format % args}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="server", description="Serve detection and export over HTTP on this machine.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1, local only)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port (default: {DEFAULT_PORT})")
+    parser.add_argument("-w", "--workers", type=int, default=2, help="Worker processes (default: 2)")
+    parser.add_argument("--max-requests", type=int,
+                        help="Detect/export requests worked on at once, the rest wait (default: 2 x workers)")
+    parser.add_argument("--queue-timeout", type=float, default=QUEUE_TIMEOUT,
+                        help=f"Seconds a request waits for a free slot before it gets 503 (default: {QUEUE_TIMEOUT:g})")
+    parser.add_argument("--templates-per-worker", type=int, default=4,
+                        help="Decoded templates each worker keeps for its sessions (default: 4)")
+    parser.add_argument("--max-upload", type=float, default=64, metavar="MB", help="Largest accepted upload (default: 64)")
+    parser.add_argument("--debug", action="store_true", help="Log every request")
+    parser.add_argument("--log-file", help="Also log to this file (rotated at 5 MB)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    setup_service_logging(args.log_file, args.debug, log)
+
+    log.info(f"Starting {args.workers} worker(s)...")
+    service = EmoteService(args.workers, args.max_requests, args.templates_per_worker, megabytes(args.max_upload),
+                           args.queue_timeout)
+    httpd = ThreadingHTTPServer((args.host, args.port), RequestHandler)
+    httpd.daemon_threads = True
+    httpd.service = service
+    # Service managers stop us with SIGTERM - shutdown() has to come from another thread than serve_forever()
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=httpd.shutdown).start())
+    log.info(f"Listening on http://{args.host}:{httpd.server_port} (workers {service.pool.pids})")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        log.info("Stopping...")
+        httpd.server_close()
+        service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
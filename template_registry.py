@@ -0,0 +1,225 @@
+"""
+Registry of known template layouts.
+
+Most sheets are drawn on one of the shipped templates, so their grid is already
+known. A cheap fingerprint (a tiny grayscale thumbnail compared only on the
+gutters/header, never inside the cells) recognises them, and detection then uses
+the stored rects instead of running the contour pipeline.
+
+Register your own template:
+    python -m template_registry register "My Layout" my_template.png
+"""
+import argparse
+import base64
+import hashlib
+import json
+import os
+import sys
+import threading
+
+import cv2
+import numpy as np
+
+from detection_cache import default_cache_dir
+
+
+# Thumbnail used as fingerprint (width, height) - aspect is checked separately
+FINGERPRINT_SIZE = (64, 48)
+# Max mean gray difference on the gutter mask to count as the same template
+MATCH_TOLERANCE = 12.0
+# Max relative difference between image aspect ratios
+ASPECT_TOLERANCE = 0.01
+
+_BASE_DIR = getattr(sys, "_MEIPASS", os.path.dirname(os.path.abspath(__file__)))
+BUILTIN_REGISTRY_PATH = os.path.join(_BASE_DIR, "known_templates.json")
+
+
+def user_registry_path():
+    """Where user registered templates are stored"""
+    return os.path.join(default_cache_dir(), "known_templates.json")
+
+
+def compute_fingerprint(gray):
+    """Downsample a grayscale image to the fingerprint thumbnail"""
+    return cv2.resize(gray, FINGERPRINT_SIZE, interpolation=cv2.INTER_AREA)
+
+
+def rects_from_transparency(template, min_area=15000):
+    """
+    Cells of the shipped templates are transparent holes - read them straight from the alpha channel.
+    Returns rects in reading order, or an empty list if the template has no such holes.
+    """
+    holes = (template.rgba[:, :, 3] == 0).astype(np.uint8)
+    _, _, stats, _ = cv2.connectedComponentsWithStats(holes)
+    rects = [tuple(int(v) for v in s[:4]) for s in stats[1:] if s[4] >= min_area]
+    return sorted(rects, key=lambda r: (r[1] // 100, r[0]))
+
+
+class KnownTemplate:
+    """One known layout: normalised cell rects plus the fingerprint to recognise it"""
+
+    def __init__(self, name, aspect, rects, fingerprint):
+        self.name = name
+        self.aspect = aspect
+        # (x, y, w, h) as fractions of the image width/height
+        self.rects = [tuple(r) for r in rects]
+        self.fingerprint = fingerprint
+        self.mask = self._gutter_mask()
+
+    def _gutter_mask(self):
+        """True where the thumbnail shows only template pixels (outside every cell, with 1px margin)"""
+        fp_w, fp_h = FINGERPRINT_SIZE
+        mask = np.ones((fp_h, fp_w), dtype=bool)
+        for x, y, w, h in self.rects:
+            x0 = max(int(np.floor(x * fp_w)) - 1, 0)
+            y0 = max(int(np.floor(y * fp_h)) - 1, 0)
+            x1 = min(int(np.ceil((x + w) * fp_w)) + 1, fp_w)
+            y1 = min(int(np.ceil((y + h) * fp_h)) + 1, fp_h)
+            mask[y0:y1, x0:x1] = False
+        return mask
+
+    @classmethod
+    def from_template(cls, name, template, rects):
+        """Build an entry from a loaded template and its pixel rects"""
+        w, h = template.width, template.height
+        norm = [(x / w, y / h, rw / w, rh / h) for x, y, rw, rh in rects]
+        return cls(name, w / h, norm, compute_fingerprint(template.gray))
+
+    @classmethod
+    def from_dict(cls, data):
+        fp = np.frombuffer(base64.b64decode(data["fingerprint"]), dtype=np.uint8)
+        return cls(data["name"], data["aspect"], data["rects"], fp.reshape(FINGERPRINT_SIZE[1], FINGERPRINT_SIZE[0]))
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "aspect": self.aspect,
+            "rects": [list(r) for r in self.rects],
+            "fingerprint": base64.b64encode(self.fingerprint.tobytes()).decode("ascii"),
+        }
+
+    def distance(self, template, fingerprint=None):
+        """Mean gray difference on the gutters, or None if the aspect ratio doesn't fit"""
+        if abs(template.width / template.height - self.aspect) > self.aspect * ASPECT_TOLERANCE:
+            return None
+        if fingerprint is None:
+            fingerprint = compute_fingerprint(template.gray)
+        diff = np.abs(fingerprint.astype(np.int16) - self.fingerprint.astype(np.int16))
+        return float(diff[self.mask].mean())
+
+    def rects_for(self, width, height):
+        """Pixel rects for an image of the given size, in reading order"""
+        return [
+            (int(round(x * width)), int(round(y * height)), int(round(w * width)), int(round(h * height)))
+            for x, y, w, h in self.rects
+        ]
+
+
+class TemplateRegistry:
+    """Built-in plus user registered templates"""
+
+    def __init__(self, paths=None):
+        self.paths = paths if paths is not None else [BUILTIN_REGISTRY_PATH, user_registry_path()]
+        self.templates = []
+        for path in self.paths:
+            self.templates.extend(self._read(path))
+
+    @staticmethod
+    def _read(path):
+        if not os.path.isfile(path):
+            return []
+        try:
+            with open(path, encoding="utf-8") as f:
+                return [KnownTemplate.from_dict(d) for d in json.load(f)]
+        except (OSError, ValueError, KeyError):
+            # A broken registry file only disables the fast path
+            return []
+
+    @property
+    def signature(self):
+        """Hash of every entry (name, aspect, rects, fingerprint) - part of the detection cache key,
+        so re-registering a template under the same name invalidates cached detections"""
+        entries = sorted(json.dumps(t.to_dict(), sort_keys=True) for t in self.templates)
+        return hashlib.blake2b("\n".join(entries).encode("utf-8"), digest_size=16).hexdigest()
+
+    def match(self, template):
+        """Return (KnownTemplate, distance) of the closest match within tolerance, or (None, None)"""
+        best, best_distance = None, None
+        fingerprint = None
+        for known in self.templates:
+            if fingerprint is None:
+                fingerprint = compute_fingerprint(template.gray)
+            distance = known.distance(template, fingerprint)
+            if distance is None or distance > MATCH_TOLERANCE:
+                continue
+            if best_distance is None or distance < best_distance:
+                best, best_distance = known, distance
+        return best, best_distance
+
+    def register(self, name, source, rects=None, path=None):
+        """
+        Add a template layout and save it to the registry file at path (default: user registry).
+        Without rects, cells come from transparent holes, or from the contour pipeline as fallback.
+        """
+        from core import find_emote_rects, _as_template
+
+        template = _as_template(source)
+        if rects is None:
+            rects = rects_from_transparency(template) or find_emote_rects(template)
+        if not rects:
+            raise ValueError(f"No cells found in {template.path}")
+
+        known = KnownTemplate.from_template(name, template, rects)
+        path = path or user_registry_path()
+        entries = [t for t in self._read(path) if t.name != name] + [known]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump([t.to_dict() for t in entries], f, indent=1)
+
+        self.templates = [t for t in self.templates if t.name != name] + [known]
+        return known
+
+
+_default_registry = None
+_default_registry_lock = threading.Lock()
+
+
+def get_template_registry():
+    """Shared per-process registry"""
+    global _default_registry
+    with _default_registry_lock:
+        if _default_registry is None:
+            _default_registry = TemplateRegistry()
+        return _default_registry
+
+
+def register_template(name, source, rects=None):
+    """Register a user template layout so detection can skip the contour pipeline for it"""
+    return get_template_registry().register(name, source, rects)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="template_registry", description="Manage known template layouts.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    reg = sub.add_parser("register", help="Register a template layout")
+    reg.add_argument("name")
+    reg.add_argument("path", help="Empty template PNG")
+    reg.add_argument("--builtin", action="store_true", help="Write to the shipped registry instead of the user one")
+
+    sub.add_parser("list", help="List known templates")
+
+    args = parser.parse_args(argv)
+    registry = get_template_registry()
+
+    if args.command == "register":
+        known = registry.register(args.name, args.path, path=BUILTIN_REGISTRY_PATH if args.builtin else None)
+        print(f"Registered '{known.name}' with {len(known.rects)} cells")
+    else:
+        for known in registry.templates:
+            print(f"{known.name}: {len(known.rects)} cells, aspect {known.aspect:.3f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
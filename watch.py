@@ -0,0 +1,444 @@
+"""
+Watch-folder service: drop templates into a folder, get exports back.
+
+Usage:
+    python -m watch drop_folder/ --platforms twitch discord --workers 2
+
+Every template (PNG, or animated APNG/GIF/WebP) that appears (or changes) in the folder is detected and exported once
+it stopped changing. Results go to <template>_emotes/ and a <template>.status.json
+next to the template tells how it went (queued, processing, done or failed).
+A <template>.names.json/.csv sidecar is picked up, and changing it re-exports.
+
+Uses inotify on Linux and polls the folder everywhere else. Jobs run in a small
+process pool that is recycled regularly, so memory stays flat over long runs.
+"""
+import argparse
+import ctypes
+import ctypes.util
+import json
+import logging
+import logging.handlers
+import os
+import select
+import signal
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, BrokenExecutor, ProcessPoolExecutor, wait
+
+from cli import TEMPLATE_EXTENSIONS, megabytes, process_template
+from animated import ANIMATED_FORMATS
+from core import DETECTION_ENGINES, ENCODING_PROFILES, EXPORT_TARGETS, RESAMPLERS, platform_sizes
+
+
+# Seconds a file must stay unchanged before it counts as completely written
+SETTLE_SECONDS = 2.0
+# Folder rescan interval without inotify (and safety rescan interval with it)
+POLL_INTERVAL = 1.0
+RESCAN_INTERVAL = 60.0
+# Worker processes are replaced after this many templates (frees anything native code held on to)
+TASKS_PER_WORKER = 25
+# A crashed worker fails every job on the pool - those are queued again and then run alone,
+# and a template that still crashes its worker that many times on its own is marked failed
+MAX_CRASH_RETRIES = 2
+
+SIDECAR_SUFFIXES = (".names.json", ".names.csv")
+PNG_TRAILER = b"\x00\x00\x00\x00IEND\xaeB`\x82"
+
+log = logging.getLogger("emote_watch")
+
+
+def status_path(template_path):
+    return os.path.splitext(template_path)[0] + ".status.json"
+
+
+def output_dir_for(template_path):
+    """Every template gets its own export folder - names like emote_1_twitch_... would collide otherwise"""
+    return os.path.splitext(template_path)[0] + "_emotes"
+
+
+def write_status(template_path, state, **details):
+    """Write <template>.status.json in one step, so readers never see half a file"""
+    path = status_path(template_path)
+    data = {"template": os.path.basename(template_path), "state": state, "updated": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    data.update(details)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def read_status(template_path):
+    try:
+        with open(status_path(template_path), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def file_signature(path):
+    """(size, mtime_ns) or None if the file is gone"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def template_complete(path):
+    """A file still being written lacks its end marker: PNG IEND chunk, GIF trailer or the full RIFF (WebP) size"""
+    try:
+        with open(path, "rb") as f:
+            head = f.read(12)
+            size = f.seek(0, os.SEEK_END)
+            if head.startswith(b"RIFF"):
+                return struct.unpack("<I", head[4:8])[0] + 8 <= size
+            f.seek(-len(PNG_TRAILER), os.SEEK_END)
+            tail = f.read()
+    except (OSError, struct.error):
+        return False
+    if head.startswith(b"GIF"):
+        return tail.endswith(b";")
+    return tail == PNG_TRAILER
+
+
+def run_job(path, options):
+    """Worker process side: mark the template as processing, then detect + export it"""
+    write_status(path, "processing")
+    return process_template(path, output_dir=output_dir_for(path), **options)
+
+
+class PollingWatcher:
+    """Fallback: no events, the service rescans the folder every interval"""
+
+    def __init__(self, directory, interval=POLL_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+
+    def wait(self, timeout):
+        """Return names that changed, or None meaning 'rescan everything'"""
+        time.sleep(min(timeout, self.interval))
+        return None
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """Linux inotify through libc - tells which files were written, moved in or deleted"""
+
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_DELETE = 0x200
+    IN_Q_OVERFLOW = 0x4000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self, directory):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        self.fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_FROM | self.IN_MOVED_TO | self.IN_DELETE
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch failed for {directory}")
+
+    def wait(self, timeout):
+        """Return names that changed within timeout, or None after a queue overflow"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        names = []
+        offset = 0
+        while offset + self.EVENT_HEADER.size <= len(data):
+            _, mask, _, length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if mask & self.IN_Q_OVERFLOW:
+                return None
+            if name:
+                names.append(os.fsdecode(name))
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+def make_watcher(directory, use_inotify=True):
+    if use_inotify:
+        try:
+            return InotifyWatcher(directory)
+        except (OSError, AttributeError) as e:
+            log.info(f"inotify not available ({e}), polling instead")
+    return PollingWatcher(directory)
+
+
+class WatchService:
+    """
+    Watches one folder and feeds settled templates to a bounded process pool.
+    State is per file in the folder (nothing grows with uptime): templates waiting
+    to settle, what was last processed and what is running right now.
+    """
+
+    def __init__(self, directory, options, workers=1, queue_size=None, settle=SETTLE_SECONDS, use_inotify=True):
+        self.directory = os.path.abspath(directory)
+        self.options = options
+        self.workers = workers
+        # Backpressure: never more than queue_size templates handed to the pool
+        self.queue_size = queue_size or workers * 2
+        self.settle = settle
+        self.use_inotify = use_inotify
+        self.pending = {}     # path -> (signature, monotonic time it last changed)
+        self.processed = {}   # path -> signature of the last processed version
+        self.in_flight = {}   # future -> (path, signature)
+        self.crashes = {}     # path -> (signature, crashes while running alone) for jobs a pool crash took down
+        self.stop_event = threading.Event()
+
+    def scan(self):
+        """Look at every template in the folder (startup, polling and overflow recovery)"""
+        present = set()
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.lower().endswith(TEMPLATE_EXTENSIONS):
+                    present.add(entry.path)
+                    self.touch(entry.path)
+        # Forget files that are gone
+        for path in [p for p in self.processed if p not in present]:
+            del self.processed[path]
+        for path in [p for p in self.pending if p not in present]:
+            del self.pending[path]
+        for path in [p for p in self.crashes if p not in present]:
+            del self.crashes[path]
+
+    def touch(self, path, force=False):
+        """Note that path may have changed; force re-processes it even if it looks unchanged"""
+        signature = file_signature(path)
+        if signature is None:
+            self.pending.pop(path, None)
+            self.processed.pop(path, None)
+            return
+        if force:
+            self.processed.pop(path, None)
+        elif self.processed.get(path) == signature:
+            return
+        old = self.pending.get(path)
+        if old is None or old[0] != signature or force:
+            self.pending[path] = (signature, time.monotonic())
+
+    def handle_event(self, name):
+        path = os.path.join(self.directory, name)
+        lower = name.lower()
+        if lower.endswith(TEMPLATE_EXTENSIONS):
+            self.touch(path)
+            return
+        for suffix in SIDECAR_SUFFIXES:
+            if lower.endswith(suffix):
+                # Names changed - export the template again
+                for ext in TEMPLATE_EXTENSIONS:
+                    template = path[:-len(suffix)] + ext
+                    if os.path.isfile(template):
+                        self.touch(template, force=True)
+
+    def load_processed(self):
+        """Templates whose status file says they were done in this exact version are skipped at startup"""
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not (entry.is_file() and entry.name.lower().endswith(TEMPLATE_EXTENSIONS)):
+                    continue
+                status = read_status(entry.path)
+                if status and status.get("state") == "done" and status.get("signature"):
+                    self.processed[entry.path] = tuple(status["signature"])
+
+    def submit_ready(self, pool):
+        now = time.monotonic()
+        busy = {path for path, _ in self.in_flight.values()}
+        if busy & self.crashes.keys():
+            # A suspect of the last pool crash is running - nothing else shares the pool with it
+            return
+        for path, (signature, since) in list(self.pending.items()):
+            if len(self.in_flight) >= self.queue_size:
+                break
+            if path in busy or now - since < self.settle:
+                continue
+            suspect = path in self.crashes
+            if suspect and self.in_flight:
+                continue
+            if self.processed.get(path) == signature:
+                # Seen again by a rescan while it was running
+                del self.pending[path]
+                continue
+            current = file_signature(path)
+            if current is None:
+                del self.pending[path]
+                continue
+            if current != signature or not template_complete(path):
+                # Still being written
+                self.pending[path] = (current, now)
+                continue
+            del self.pending[path]
+            write_status(path, "queued")
+            self.in_flight[pool.submit(run_job, path, self.options)] = (path, signature)
+            log.info(f"Queued {os.path.basename(path)}{' (alone, after a worker crash)' if suspect else ''}")
+            if suspect:
+                break
+
+    def collect(self, timeout=0):
+        """Record finished jobs; returns False if the pool broke and has to be replaced"""
+        if not self.in_flight:
+            return True
+        done, _ = wait(list(self.in_flight), timeout=timeout, return_when=FIRST_COMPLETED)
+        healthy = True
+        for future in done:
+            path, signature = self.in_flight.pop(future)
+            try:
+                r = future.result()
+            except Exception as e:
+                if isinstance(e, BrokenExecutor):
+                    healthy = False
+                    # Maybe this sheet crashed the worker, maybe it only shared the pool with one that did:
+                    # it runs alone next time, and only crashes while alone count against it
+                    crashed, count = self.crashes.get(path, (None, 0))
+                    count = count + 1 if crashed == signature else 0
+                    self.crashes[path] = (signature, count)
+                    if count < MAX_CRASH_RETRIES:
+                        log.warning(f"Worker pool broke while running {os.path.basename(path)}, queuing it again")
+                        self.pending.setdefault(path, (signature, time.monotonic()))
+                        continue
+                log.error(f"Failed {os.path.basename(path)}: {e}")
+                if os.path.exists(path):
+                    write_status(path, "failed", error=str(e), signature=list(signature))
+                # Don't retry the same broken file until it changes
+                self.processed[path] = signature
+                continue
+            self.crashes.pop(path, None)
+            self.processed[path] = signature
+            write_status(
+                path, "done", signature=list(signature), cells=r["cells"], emotes=r["emotes"], files=r["files"],
+                output=r["out_dir"], seconds=round(r["total_time"], 3),
+                written=r["written"], skipped=r["skipped"], deleted=r["deleted"],
+            )
+            log.info(
+                f"Done {os.path.basename(path)}: {r['emotes']} emotes, {r['written']} files written, "
+                f"{r['skipped']} unchanged in {r['total_time']:.2f}s"
+            )
+        return healthy
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        watcher = make_watcher(self.directory, self.use_inotify)
+        pool = ProcessPoolExecutor(max_workers=self.workers, max_tasks_per_child=TASKS_PER_WORKER)
+        log.info(f"Watching {self.directory} ({type(watcher).__name__}, {self.workers} worker(s))")
+        try:
+            self.load_processed()
+            self.scan()
+            last_scan = time.monotonic()
+            while not self.stop_event.is_set():
+                # Short waits while something is settling or running, so results show up promptly
+                timeout = 0.2 if self.pending or self.in_flight else POLL_INTERVAL
+                names = watcher.wait(timeout)
+                if names is None or time.monotonic() - last_scan > RESCAN_INTERVAL:
+                    self.scan()
+                    last_scan = time.monotonic()
+                else:
+                    for name in names:
+                        self.handle_event(name)
+
+                if not self.collect():
+                    # A crashed worker takes the pool down - start a fresh one
+                    log.warning("Worker pool broke, restarting it")
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    pool = ProcessPoolExecutor(max_workers=self.workers, max_tasks_per_child=TASKS_PER_WORKER)
+                self.submit_ready(pool)
+        finally:
+            log.info("Stopping, waiting for running jobs...")
+            pool.shutdown(wait=True, cancel_futures=True)
+            self.collect()
+            watcher.close()
+
+
+def setup_service_logging(log_file=None, verbose=False, logger=None):
+    """Console logging plus an optional size-capped log file (for the watch service's logger by default)"""
+    logger = logger or log
+    logger.setLevel(logging.DEBUG if verbose else logging.INFO)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+    formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.handlers.RotatingFileHandler(log_file, maxBytes=5 * 2**20, backupCount=3))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="watch", description="Watch a folder and export every template dropped into it.")
+    parser.add_argument("directory", help="Folder to watch")
+    parser.add_argument(
+        "-p", "--platforms", nargs="+", default=["twitch"],
+        choices=sorted(platform_sizes), help="Platforms to export (default: twitch)",
+    )
+    parser.add_argument("-w", "--workers", type=int, default=1, help="Worker processes (default: 1)")
+    parser.add_argument("-q", "--queue-size", type=int, help="Max templates queued or running at once (default: 2 x workers)")
+    parser.add_argument(
+        "-e", "--engine", default="contours", choices=sorted(DETECTION_ENGINES),
+        help="Rect finding engine for unknown layouts (default: contours)",
+    )
+    parser.add_argument("--encoding", default="balanced", choices=list(ENCODING_PROFILES), help="PNG encoding profile")
+    parser.add_argument("-t", "--target", default="folder", choices=EXPORT_TARGETS, help="Export as loose PNGs or ZIP(s)")
+    parser.add_argument("--animated-format", default="gif", choices=ANIMATED_FORMATS,
+                        help="Output format for animated templates (default: gif)")
+    parser.add_argument("--resampler", default="pil", choices=sorted(RESAMPLERS), help="Resize backend (default: pil)")
+    parser.add_argument("--memory-budget", type=float, metavar="MB",
+                        help="Detect sheets needing more memory than this in strips (same results)")
+    parser.add_argument("--settle", type=float, default=SETTLE_SECONDS,
+                        help=f"Seconds a file must be unchanged before processing (default: {SETTLE_SECONDS})")
+    parser.add_argument("--poll", action="store_true", help="Poll the folder even where inotify is available")
+    parser.add_argument("--debug", action="store_true", help="Write debug logs and images")
+    parser.add_argument("--log-file", help="Also log to this file (rotated at 5 MB)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if not os.path.isdir(args.directory):
+        print(f"Not a folder: {args.directory}", file=sys.stderr)
+        return 1
+    setup_service_logging(args.log_file, args.debug)
+
+    options = {
+        "platforms": args.platforms,
+        "debug_enabled": args.debug,
+        "engine": args.engine,
+        "encoding": args.encoding,
+        "target": args.target,
+        "animated_format": args.animated_format,
+        "resampler": args.resampler,
+        "memory_budget": megabytes(args.memory_budget),
+    }
+    service = WatchService(args.directory, options, args.workers, args.queue_size, args.settle, not args.poll)
+    # Service managers stop us with SIGTERM - finish running jobs instead of dying mid-export
+    signal.signal(signal.SIGTERM, lambda signum, frame: service.stop())
+    try:
+        service.run()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())